@@ -0,0 +1,23 @@
+"""One-time migration: NOTIFY email_pending when outbound mail is queued."""
+import sys, os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.database import Database
+
+with Database.get_cursor() as cur:
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION notify_email_pending()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NOTIFY email_pending;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS notify_project_messages_outbound ON project_messages")
+    cur.execute("""
+        CREATE TRIGGER notify_project_messages_outbound AFTER INSERT ON project_messages
+            FOR EACH ROW WHEN (NEW.direction = 'outbound' AND NEW.is_processed IS NOT TRUE)
+            EXECUTE FUNCTION notify_email_pending()
+    """)
+    print("OK: notify_project_messages_outbound")
@@ -0,0 +1,9 @@
+"""One-time migration: claimed_at column used to reserve outbound mail for one sender."""
+import sys, os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.database import Database
+
+with Database.get_cursor() as cur:
+    cur.execute("ALTER TABLE project_messages ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP")
+    print("OK: project_messages.claimed_at")
@@ -0,0 +1,59 @@
+"""One-time migration: add indexes used by the workflow engine and mail worker."""
+import sys, os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.database import Database
+
+with Database.get_cursor() as cur:
+    # Workflow engine keyset scan: WHERE current_state IN (...) ORDER BY created_at, id
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_projects_state_created
+        ON projects(current_state, created_at, id)
+    """)
+    print("OK: idx_projects_state_created")
+
+    # Email threading lookups: message_id = ANY(References + In-Reply-To)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_project_messages_message_id
+        ON project_messages(message_id) WHERE message_id IS NOT NULL
+    """)
+    print("OK: idx_project_messages_message_id")
+
+    # Freelancer.com reply matching: title ILIKE '%...%' (leading wildcard)
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_projects_title_trgm
+        ON projects USING gin (title gin_trgm_ops)
+    """)
+    print("OK: idx_projects_title_trgm")
+    # Subjects are matched on subject_norm now; the trigram index served no query
+    cur.execute("DROP INDEX IF EXISTS idx_project_messages_subject_trgm")
+    print("OK: dropped idx_project_messages_subject_trgm")
+
+    # Reply matching by normalized subject: equality on generated columns
+    cur.execute(r"""
+        ALTER TABLE projects ADD COLUMN IF NOT EXISTS title_norm TEXT
+        GENERATED ALWAYS AS (btrim(lower(regexp_replace(title, '^(re:\s*)+', '', 'i')))) STORED
+    """)
+    cur.execute(r"""
+        ALTER TABLE project_messages ADD COLUMN IF NOT EXISTS subject_norm TEXT
+        GENERATED ALWAYS AS (btrim(lower(regexp_replace(subject, '^(re:\s*)+', '', 'i')))) STORED
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_projects_title_norm ON projects(title_norm)")
+    print("OK: idx_projects_title_norm")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_project_messages_subject_norm ON project_messages(subject_norm)")
+    print("OK: idx_project_messages_subject_norm")
+
+    # Outbound queue: pending rows in send order, and NULL-recipient cleanup
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_project_messages_pending_outbound
+        ON project_messages(created_at)
+        WHERE direction = 'outbound' AND is_processed = FALSE
+    """)
+    print("OK: idx_project_messages_pending_outbound")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_project_messages_null_outbound
+        ON project_messages(id)
+        WHERE recipient_email IS NULL AND direction = 'outbound'
+    """)
+    print("OK: idx_project_messages_null_outbound")
@@ -3,6 +3,7 @@ import json
 import re
 from app.ai_client import get_ai_client
 from app.database import Database
+from app.json_compat import json_dumps, json_loads
 
 
 class BaseAgent(ABC):
@@ -78,7 +79,7 @@ class BaseAgent(ABC):
         parsed = self.ai_client.parse_json_response(content)
         if parsed is None:
             try:
-                parsed = json.loads(content)
+                parsed = json_loads(content)
             except json.JSONDecodeError:
                 parsed = {}
         parsed['_usage'] = result.get('usage', {})
@@ -99,8 +100,8 @@ class BaseAgent(ABC):
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
                 """, (
                     self.agent_name, project_id, action,
-                    json.dumps(input_data) if isinstance(input_data, (dict, list)) else input_data,
-                    json.dumps(output_data) if isinstance(output_data, (dict, list)) else output_data,
+                    json_dumps(input_data) if isinstance(input_data, (dict, list)) else input_data,
+                    json_dumps(output_data) if isinstance(output_data, (dict, list)) else output_data,
                     success, error_message, execution_time_ms, tokens_used, cost
                 ))
         except Exception as e:
@@ -115,7 +116,7 @@ class BaseAgent(ABC):
                     VALUES (%s, %s, %s, %s, %s, %s)
                 """, (
                     project_id, from_state, to_state, self.agent_name, reason,
-                    json.dumps(metadata) if metadata else None
+                    json_dumps(metadata) if metadata else None
                 ))
         except Exception as e:
             print(f"Failed to log state transition: {e}")
@@ -160,4 +161,11 @@ class BaseAgent(ABC):
         """Get full project data from database"""
         with Database.get_cursor() as cursor:
             cursor.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
-            return cursor.fetchone()
\ No newline at end of file
+            return cursor.fetchone()
+
+    def resolve_project(self, project_data):
+        """Return the full project row, reusing the one preloaded by the workflow engine"""
+        if project_data.get('_full_row'):
+            # Set by the engine query, which selects every projects column
+            return project_data
+        return self.get_project(project_data['id'])
@@ -32,7 +32,7 @@ class DialogueOrchestratorAgent(BaseAgent):
             return None
 
         # Get full project context
-        project = self.get_project(project_id)
+        project = self.resolve_project(project_data)
         if not project:
             return None
 
@@ -20,7 +20,7 @@ class EstimationAgent(BaseAgent):
         project_id = project_data['id']
 
         # Get full project data from DB
-        project = self.get_project(project_id)
+        project = self.resolve_project(project_data)
         if not project:
             return None
 
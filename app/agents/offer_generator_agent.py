@@ -23,7 +23,7 @@ class OfferGeneratorAgent(BaseAgent):
         project_id = project_data['id']
 
         # Get full project data
-        project = self.get_project(project_id)
+        project = self.resolve_project(project_data)
         if not project:
             return None
 
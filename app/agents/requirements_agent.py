@@ -30,7 +30,7 @@ class RequirementsAnalysisAgent(BaseAgent):
     def process(self, project_data):
         project_id = project_data['id']
 
-        project = self.get_project(project_id)
+        project = self.resolve_project(project_data)
         if not project:
             return None
 
@@ -56,7 +56,9 @@ class RequirementsAnalysisAgent(BaseAgent):
             pass
 
         # Get conversation history (client replies after clarification questions)
-        client_replies = self._get_client_replies(project_id)
+        client_replies = project_data.get('recent_inbound')
+        if client_replies is None:
+            client_replies = self._get_client_replies(project_id)
 
         self.log_action(project_id, "REQUIREMENTS_ANALYSIS_STARTED",
                         input_data={'round': clarification_round + 1})
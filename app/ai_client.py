@@ -4,6 +4,7 @@ OpenAI API Client for AI Freelance Operator
 
 from openai import OpenAI
 from config import Config
+from app.json_compat import json_loads
 import json
 import time
 
@@ -19,6 +20,9 @@ class AIClient:
         self.model = Config.OPENAI_MODEL
         self.temperature = Config.OPENAI_TEMPERATURE
         self.max_tokens = Config.OPENAI_MAX_TOKENS
+        # Outcome of the most recent API call (None = not used yet). Real
+        # traffic validates the key, so no separate paid probe is needed.
+        self.last_ok = None
     
     def chat_completion(self, messages, temperature=None, max_tokens=None, 
                        response_format=None, tools=None):
@@ -52,6 +56,7 @@ class AIClient:
         
         try:
             response = self.client.chat.completions.create(**kwargs)
+            self.last_ok = True
             
             execution_time = int((time.time() - start_time) * 1000)  # ms
             
@@ -77,6 +82,7 @@ class AIClient:
             return result
             
         except Exception as e:
+            self.last_ok = False
             raise Exception(f"OpenAI API error: {str(e)}")
     
     def _calculate_cost(self, usage):
@@ -162,7 +168,7 @@ class AIClient:
                 end = content.find("```", start)
                 content = content[start:end].strip()
             
-            return json.loads(content)
+            return json_loads(content)
         except json.JSONDecodeError:
             return None
     
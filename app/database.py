@@ -2,10 +2,40 @@
 Database utilities for AI Freelance Operator
 """
 
+import threading
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from config import Config
+from app.json_compat import json_dumps, json_loads
+
+_pool = None
+_pool_lock = threading.Lock()
+# One slot per pooled connection: callers wait here for a free connection
+# instead of getconn() raising PoolError once DB_POOL_MAX are checked out
+_pool_slots = threading.BoundedSemaphore(Config.DB_POOL_MAX)
+
+
+def _connect_kwargs():
+    return dict(
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        dbname=Config.DB_NAME,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD
+    )
+
+
+def _get_pool():
+    """Process-wide thread-safe connection pool (created on first use)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pool.ThreadedConnectionPool(1, Config.DB_POOL_MAX, **_connect_kwargs())
+    return _pool
 
 
 class Database:
@@ -14,22 +44,33 @@ class Database:
     @staticmethod
     @contextmanager
     def get_connection():
-        """Get a database connection context manager"""
-        conn = psycopg2.connect(
-            host=Config.DB_HOST,
-            port=Config.DB_PORT,
-            dbname=Config.DB_NAME,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD
-        )
+        """
+        Get a database connection context manager (pooled, one per caller).
+        At most DB_POOL_MAX are open; when all are in use, wait up to
+        DB_POOL_TIMEOUT seconds for one to be returned, then raise PoolError.
+        """
+        db_pool = _get_pool()
+        if not _pool_slots.acquire(timeout=Config.DB_POOL_TIMEOUT):
+            raise pool.PoolError("connection pool exhausted")
+        try:
+            conn = db_pool.getconn()
+        except Exception:
+            _pool_slots.release()
+            raise
+        broken = False
         try:
             yield conn
             conn.commit()
         except Exception as e:
-            conn.rollback()
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
             raise e
         finally:
-            conn.close()
+            broken = broken or bool(conn.closed)
+            db_pool.putconn(conn, close=broken)
+            _pool_slots.release()
     
     @staticmethod
     @contextmanager
@@ -43,6 +84,54 @@ class Database:
             finally:
                 cursor.close()
     
+    @staticmethod
+    def stream_rows(query, params=None, name='stream', itersize=50):
+        """
+        Iterate over query results through a server-side (named) cursor.
+
+        Rows are pulled from PostgreSQL in chunks of `itersize` instead of
+        being buffered client-side, so memory stays constant for large scans.
+        """
+        with Database.get_connection() as conn:
+            cursor = conn.cursor(name=name, cursor_factory=RealDictCursor)
+            cursor.itersize = itersize
+            try:
+                cursor.execute(query, params)
+                for row in cursor:
+                    yield row
+            finally:
+                # Release the server-side portal
+                cursor.close()
+
+    @staticmethod
+    def listen(channel):
+        """
+        Open a dedicated autocommit connection subscribed to a NOTIFY channel.
+        Not pooled: the caller owns it and waits on it with select().
+        """
+        conn = psycopg2.connect(**_connect_kwargs())
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+        return conn
+
+    @staticmethod
+    def try_advisory_lock(lock_id):
+        """
+        Try to take a session-level pg advisory lock on a dedicated connection.
+        Returns the connection (the lock lives as long as it stays open),
+        or None if another session already holds the lock.
+        """
+        conn = psycopg2.connect(**_connect_kwargs())
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (lock_id,))
+            acquired = cursor.fetchone()[0]
+        if not acquired:
+            conn.close()
+            return None
+        return conn
+
     @staticmethod
     def init_schema():
         """Initialize database schema from schema.sql"""
@@ -106,8 +195,7 @@ class QueryHelper:
             elif value_type == 'boolean':
                 return value.lower() == 'true'
             elif value_type == 'json':
-                import json
-                return json.loads(value)
+                return json_loads(value)
             else:
                 return value
     
@@ -131,8 +219,6 @@ class QueryHelper:
                         output_data=None, success=True, error_message=None,
                         execution_time_ms=None, tokens_used=None, cost=None):
         """Log an agent action"""
-        import json
-        
         with Database.get_cursor() as cursor:
             cursor.execute(
                 """
@@ -146,8 +232,8 @@ class QueryHelper:
                     agent_name, 
                     project_id, 
                     action,
-                    json.dumps(input_data) if input_data else None,
-                    json.dumps(output_data) if output_data else None,
+                    json_dumps(input_data) if input_data else None,
+                    json_dumps(output_data) if output_data else None,
                     success,
                     error_message,
                     execution_time_ms,
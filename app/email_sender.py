@@ -3,8 +3,10 @@ Email Sender — SMTP client for sending emails to clients.
 Used by the workflow to send offers, replies, and notifications.
 """
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from psycopg2.extras import RealDictCursor
 from config import Config
 from app.database import Database, QueryHelper
 
@@ -16,6 +18,13 @@ class EmailSender:
         self.smtp_host = Config.SMTP_HOST
         self.smtp_port = Config.SMTP_PORT
         self.use_tls = Config.SMTP_USE_TLS
+        # Persistent SMTP session, reused across batches while the server keeps it
+        self._server = None
+        self._server_user = None
+        self._lock = threading.Lock()
+        # Seconds a claimed outbound row stays reserved for this drainer
+        self.claim_timeout = 15 * 60
+        self._no_credentials_logged = False  # report missing credentials once
 
     def _get_credentials(self):
         """Get SMTP credentials from system settings (priority) or config"""
@@ -27,6 +36,64 @@ class EmailSender:
                    Config.SMTP_PASSWORD
         return username, password
 
+    def _connect(self, username, password):
+        """Open an authenticated SMTP connection"""
+        if self.use_tls:
+            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
+            server.starttls()
+        else:
+            server = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port)
+        server.login(username, password)
+        return server
+
+    @staticmethod
+    def _close(server):
+        """Close an SMTP connection, ignoring errors on an already-dead socket"""
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+    def _session(self, username, password):
+        """Return the persistent SMTP session, reconnecting if it went stale.
+        Caller must hold self._lock."""
+        if self._server is not None and self._server_user == username:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._drop_session()
+        self._server = self._connect(username, password)
+        self._server_user = username
+        return self._server
+
+    def _drop_session(self):
+        """Close the persistent SMTP session (if any)"""
+        if self._server is not None:
+            self._close(self._server)
+        self._server = None
+        self._server_user = None
+
+    def _build_message(self, username, to_email, subject, body, html_body=None, from_name=None):
+        """Build the MIME message for one email"""
+        if from_name is None:
+            # Use business identity: "Andrii Pylypchuk | AndriiIT"
+            from_name = f"{Config.BUSINESS_OWNER} | {Config.BUSINESS_NAME}" if Config.BUSINESS_OWNER else Config.BUSINESS_NAME
+
+        msg = MIMEMultipart('alternative')
+        msg['From'] = f"{from_name} <{username}>"
+        msg['To'] = to_email
+        msg['Subject'] = subject
+
+        # Add plain text
+        msg.attach(MIMEText(body, 'plain', 'utf-8'))
+
+        # Add HTML if provided
+        if html_body:
+            msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+        return msg
+
     def send_email(self, to_email, subject, body, html_body=None, from_name=None):
         """
         Send an email.
@@ -41,9 +108,6 @@ class EmailSender:
         Returns:
             bool: True if sent successfully
         """
-        if from_name is None:
-            # Use business identity: "Andrii Pylypchuk | AndriiIT"
-            from_name = f"{Config.BUSINESS_OWNER} | {Config.BUSINESS_NAME}" if Config.BUSINESS_OWNER else Config.BUSINESS_NAME
         username, password = self._get_credentials()
 
         if not username or not password:
@@ -51,29 +115,14 @@ class EmailSender:
             return False
 
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['From'] = f"{from_name} <{username}>"
-            msg['To'] = to_email
-            msg['Subject'] = subject
-
-            # Add plain text
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-
-            # Add HTML if provided
-            if html_body:
-                msg.attach(MIMEText(html_body, 'html', 'utf-8'))
-
-            # Send
-            if self.use_tls:
-                server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-                server.starttls()
-            else:
-                server = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port)
-
-            server.login(username, password)
-            server.send_message(msg)
-            server.quit()
+            msg = self._build_message(username, to_email, subject, body, html_body, from_name)
+            with self._lock:
+                try:
+                    self._session(username, password).send_message(msg)
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                    # Server closed the idle session between checks — reopen once
+                    self._drop_session()
+                    self._session(username, password).send_message(msg)
 
             print(f"[EmailSender] Email sent to {to_email}: {subject}")
             return True
@@ -82,45 +131,101 @@ class EmailSender:
             print(f"[EmailSender] Failed to send email to {to_email}: {e}")
             return False
 
-    def send_pending_messages(self):
+    def send_pending_messages(self, batch_size=100):
         """
         Send all pending outbound messages from the project_messages table.
         Called periodically by the background scheduler.
+
+        The batch is claimed by stamping claimed_at in the same statement that
+        selects it (FOR UPDATE SKIP LOCKED) and committed at once, so another
+        drainer skips these rows for claim_timeout even though no row lock is
+        held while sending. Messages go out over the persistent SMTP session
+        (kept open between batches, NOOP-checked before reuse); each row is
+        committed as sent right after delivery, and a failed send releases
+        its claim for the next drain.
         Returns number of messages sent.
         """
+        sent_count = 0
+        self._lock.acquire()
         try:
-            with Database.get_cursor() as cursor:
-                # Get unsent outbound messages that have a valid recipient
+            with Database.get_connection() as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                # Claim unsent outbound messages that have a valid recipient;
+                # a claim older than claim_timeout belongs to a crashed drainer
                 cursor.execute("""
-                    SELECT id, project_id, recipient_email, subject, body, html_body
-                    FROM project_messages
-                    WHERE direction = 'outbound' AND is_processed = FALSE
-                      AND recipient_email IS NOT NULL AND recipient_email != ''
-                    ORDER BY created_at ASC
-                    LIMIT 10
-                """)
-                messages = cursor.fetchall()
-
-            if not messages:
-                return 0
-
-            sent_count = 0
-            for msg in messages:
-                success = self.send_email(
-                    to_email=msg['recipient_email'],
-                    subject=msg['subject'] or 'No Subject',
-                    body=msg['body'] or '',
-                    html_body=msg.get('html_body')
-                )
-
-                if success:
-                    # Mark as sent
-                    with Database.get_cursor() as cursor:
+                    UPDATE project_messages SET claimed_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM project_messages
+                        WHERE direction = 'outbound' AND is_processed = FALSE
+                          AND recipient_email IS NOT NULL AND recipient_email != ''
+                          AND (claimed_at IS NULL
+                               OR claimed_at < NOW() - %s * INTERVAL '1 second')
+                        ORDER BY created_at ASC
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, project_id, recipient_email, subject, body, html_body, created_at
+                """, (self.claim_timeout, batch_size))
+                messages = sorted(cursor.fetchall(), key=lambda m: (m['created_at'], m['id']))
+                conn.commit()
+                if not messages:
+                    return 0
+
+                # Credentials are read only when there is something to send
+                username, password = self._get_credentials()
+                server = None
+                try:
+                    if not username or not password:
+                        if not self._no_credentials_logged:
+                            print("[EmailSender] SMTP credentials not configured")
+                            self._no_credentials_logged = True
+                    else:
+                        self._no_credentials_logged = False
+                        # Reuse the open session; STARTTLS + AUTH only when it went stale
+                        server = self._session(username, password)
+                finally:
+                    if server is None:
+                        # Nothing was sent — hand the whole batch back
+                        cursor.execute(
+                            "UPDATE project_messages SET claimed_at = NULL WHERE id = ANY(%s)",
+                            ([m['id'] for m in messages],)
+                        )
+                        conn.commit()
+                if server is None:
+                    return 0
+
+                for msg in messages:
+                    to_email = msg['recipient_email']
+                    subject = msg['subject'] or 'No Subject'
+                    try:
+                        mime = self._build_message(
+                            username, to_email, subject, msg['body'] or '', msg.get('html_body')
+                        )
+                        try:
+                            server.send_message(mime)
+                        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                            # Session dropped mid-batch — reopen once and retry
+                            self._drop_session()
+                            server = self._session(username, password)
+                            server.send_message(mime)
+                    except Exception as e:
+                        print(f"[EmailSender] Failed to send email to {to_email}: {e}")
+                        # Release the claim so the next drain retries it
                         cursor.execute(
-                            "UPDATE project_messages SET is_processed = TRUE WHERE id = %s",
+                            "UPDATE project_messages SET claimed_at = NULL WHERE id = %s",
                             (msg['id'],)
                         )
+                        conn.commit()
+                        continue
+
+                    # Mark as sent
+                    cursor.execute(
+                        "UPDATE project_messages SET is_processed = TRUE WHERE id = %s",
+                        (msg['id'],)
+                    )
+                    conn.commit()
                     sent_count += 1
+                    print(f"[EmailSender] Email sent to {to_email}: {subject}")
 
                     # Log
                     QueryHelper.log_agent_action(
@@ -128,19 +233,24 @@ class EmailSender:
                         action='EMAIL_SENT',
                         project_id=msg['project_id'],
                         output_data={
-                            'to': msg['recipient_email'],
+                            'to': to_email,
                             'subject': msg['subject']
                         }
                     )
+                cursor.close()
+                # Reset envelope state; the session stays open for the next batch
+                server.rset()
 
             if sent_count > 0:
                 print(f"[EmailSender] Sent {sent_count} pending message(s)")
 
-            return sent_count
-
         except Exception as e:
             print(f"[EmailSender] Error processing pending messages: {e}")
-            return 0
+            self._drop_session()
+        finally:
+            self._lock.release()
+
+        return sent_count
 
     def test_connection(self):
         """Test SMTP connection"""
@@ -150,14 +260,8 @@ class EmailSender:
             return False, "SMTP credentials not configured"
 
         try:
-            if self.use_tls:
-                server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-                server.starttls()
-            else:
-                server = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port)
-
-            server.login(username, password)
-            server.quit()
+            server = self._connect(username, password)
+            self._close(server)
             return True, "Connection successful"
 
         except Exception as e:
@@ -69,8 +69,7 @@ class FreelancerClient:
             options.add_argument("--disable-blink-features=AutomationControlled")
             options.add_argument("--disable-gpu")
             # Headless by default on servers; set FREELANCER_HEADLESS=false for debug
-            headless = (getattr(Config, 'FREELANCER_HEADLESS', 'true') or 'true').lower()
-            if headless != 'false':
+            if getattr(Config, 'FREELANCER_HEADLESS', True):
                 options.add_argument("--headless=new")
 
             self._driver = uc.Chrome(options=options)
@@ -0,0 +1,18 @@
+"""
+JSON encode/decode helpers for AI Freelance Operator.
+
+Uses orjson when it is installed (several times faster on the AI responses
+and agent-log payloads handled on every workflow step) and falls back to
+the stdlib json module otherwise. Both variants return str from json_dumps
+and raise a json.JSONDecodeError subclass from json_loads.
+"""
+try:
+    import orjson
+
+    def json_dumps(obj):
+        # OPT_NON_STR_KEYS: int keys are converted like the stdlib does
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
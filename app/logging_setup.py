@@ -0,0 +1,34 @@
+"""
+Logging setup for AI Freelance Operator.
+
+Background workers log from several threads. Records are pushed onto an
+in-memory queue and written to stdout by a single listener thread, so
+worker threads never block on console / journald I/O.
+"""
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+_listener = None
+
+
+def setup_logging(level=logging.INFO):
+    """Route root logger output through a QueueHandler (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s: %(message)s'
+    ))
+
+    log_queue = queue.Queue(-1)
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
@@ -57,8 +57,21 @@ def index():
 
 @main.route("/health")
 def health():
-    """Health check endpoint"""
-    return jsonify({"status": "ok"})
+    """Health check endpoint (?deep=1 also checks the database and OpenAI)"""
+    if request.args.get("deep") != "1":
+        return jsonify({"status": "ok"})
+
+    db_ok = Database.test_connection()
+    try:
+        ai_ok = get_ai_client().test_connection()
+    except Exception:
+        ai_ok = False
+    ok = db_ok and ai_ok
+    return jsonify({
+        "status": "ok" if ok else "degraded",
+        "database": db_ok,
+        "openai": ai_ok,
+    }), 200 if ok else 503
 
 
 @main.route("/api/status")
@@ -67,11 +80,12 @@ def status():
     try:
         db_connected = Database.test_connection()
         
+        # Last known OpenAI state from real traffic — no paid probe per poll
         ai_status = "unknown"
         try:
             ai_client = get_ai_client()
-            ai_connected = ai_client.test_connection()
-            ai_status = "connected" if ai_connected else "disconnected"
+            if ai_client.last_ok is not None:
+                ai_status = "connected" if ai_client.last_ok else "disconnected"
         except:
             ai_status = "not_configured"
         
@@ -946,7 +960,7 @@ def test_telegram():
     try:
         from app.telegram_notifier import get_notifier
         tg = get_notifier()
-        ok = tg.send("🤖 <b>AI Freelance Operator</b>\n\nТестовое сообщение. Telegram-уведомления работают!")
+        ok = tg.send_now("🤖 <b>AI Freelance Operator</b>\n\nТестовое сообщение. Telegram-уведомления работают!")
         if ok:
             return jsonify({"success": True, "message": "Тестовое сообщение отправлено!"})
         else:
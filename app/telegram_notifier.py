@@ -2,10 +2,12 @@
 Telegram Notifier — sends event notifications to the owner via Telegram Bot API.
 
 Uses raw HTTP requests (no async framework needed).
-All methods are fire-and-forget: errors are logged but never raised,
-so a Telegram outage can never break the main workflow.
+All methods are fire-and-forget: messages are queued and delivered by one
+background thread over a keep-alive session; errors are logged but never
+raised, so a Telegram outage can never break the main workflow.
 """
 import json
+import queue
 import time
 import threading
 import requests
@@ -44,13 +46,43 @@ class TelegramNotifier:
         self._lock = threading.Lock()
         self._last_send = 0.0  # timestamp of last successful send
         self._MIN_INTERVAL = 0.5  # min seconds between messages
+        self._session = requests.Session()  # TCP + TLS kept alive between sends
+        self._queue = queue.Queue(maxsize=1000)
+        self._worker = None
+        self._worker_lock = threading.Lock()  # separate from _lock, which is held while sending
         if not self._enabled:
             print("[Telegram] Bot token or owner ID not configured — notifications disabled")
 
     # ───────── low-level ─────────
 
     def send(self, text: str, parse_mode: str = 'HTML') -> bool:
-        """Send a raw message with rate-limit handling. Returns True on success."""
+        """Queue a message for the background sender. Returns True if queued."""
+        if not self._enabled:
+            return False
+
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._drain, name='telegram-sender',
+                                                 daemon=True)
+                self._worker.start()
+        try:
+            self._queue.put_nowait((text, parse_mode))
+            return True
+        except queue.Full:
+            print("[Telegram] Queue full — dropping message")
+            return False
+
+    def _drain(self):
+        """Deliver queued messages one by one (runs on the sender thread)."""
+        while True:
+            text, parse_mode = self._queue.get()
+            try:
+                self.send_now(text, parse_mode)
+            finally:
+                self._queue.task_done()
+
+    def send_now(self, text: str, parse_mode: str = 'HTML') -> bool:
+        """Send a raw message synchronously with rate-limit handling. Returns True on success."""
         if not self._enabled:
             return False
 
@@ -63,7 +95,7 @@ class TelegramNotifier:
             for attempt in range(3):
                 try:
                     url = _BASE_URL.format(token=self.token)
-                    resp = requests.post(url, json={
+                    resp = self._session.post(url, json={
                         'chat_id': self.chat_id,
                         'text': text[:4096],
                         'parse_mode': parse_mode,
@@ -214,9 +246,12 @@ def _esc(text: str) -> str:
 
 # ── Singleton ──
 _notifier = None
+_notifier_lock = threading.Lock()
 
 def get_notifier() -> TelegramNotifier:
     global _notifier
     if _notifier is None:
-        _notifier = TelegramNotifier()
+        with _notifier_lock:  # mail handler threads may race on first use
+            if _notifier is None:
+                _notifier = TelegramNotifier()
     return _notifier
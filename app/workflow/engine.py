@@ -8,9 +8,10 @@ Orchestrates the project lifecycle through state transitions:
 Each state has an assigned agent that processes projects in that state
 and returns the next state.
 """
-import time
+import queue
 import threading
 import json
+import logging
 from app.database import Database
 from app.agents.email_parser_agent import EmailParserAgent
 from app.agents.scam_filter_agent import ScamFilterAgent
@@ -21,6 +22,8 @@ from app.agents.offer_generator_agent import OfferGeneratorAgent
 from app.agents.dialogue_orchestrator_agent import DialogueOrchestratorAgent
 from app.telegram_notifier import get_notifier
 
+log = logging.getLogger(__name__)
+
 
 # Terminal states — no further processing
 TERMINAL_STATES = {'CLOSED', 'REJECTED'}
@@ -28,6 +31,65 @@ TERMINAL_STATES = {'CLOSED', 'REJECTED'}
 # States that require human action (no auto-processing)
 MANUAL_STATES = {'AGREED', 'FUNDED', 'EXECUTION_READY'}
 
+# Number of most recent inbound message bodies preloaded with each project
+RECENT_INBOUND_LIMIT = 5
+
+# Project rows handed to agents: every projects column plus the latest inbound
+# bodies, so agents don't re-query them one project at a time. _full_row tells
+# BaseAgent.resolve_project the row is already complete.
+_PROJECT_SELECT = f"""
+    SELECT p.*,
+           m.recent_inbound,
+           TRUE AS _full_row
+    FROM projects p
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(array_agg(recent.body ORDER BY recent.created_at), ARRAY[]::text[])
+               AS recent_inbound
+        FROM (
+            SELECT pm.body, pm.created_at
+            FROM project_messages pm
+            WHERE pm.project_id = p.id AND pm.direction = 'inbound'
+              AND pm.body IS NOT NULL AND pm.body <> ''
+            ORDER BY pm.created_at DESC
+            LIMIT {RECENT_INBOUND_LIMIT}
+        ) recent
+    ) m ON TRUE
+"""
+
+# Map: current_state → agent class
+_AGENT_CLASSES = {
+    'NEW':              EmailParserAgent,
+    'PARSED':           ScamFilterAgent,
+    'ANALYZED':         ClassificationAgent,
+    'CLASSIFIED':       RequirementsAnalysisAgent,
+    'REQUIREMENTS_ANALYZED': EstimationAgent,
+    'ESTIMATION_READY': OfferGeneratorAgent,
+    'NEGOTIATION':      DialogueOrchestratorAgent,
+}
+
+# States that always auto-process vs. states that need a trigger (new client reply)
+_EVENT_STATES = ['NEGOTIATION']
+_AUTO_STATES = [s for s in _AGENT_CLASSES if s not in _EVENT_STATES]
+
+# Agent instances are created on first use and shared by all engine instances
+_AGENTS = {}
+_agents_lock = threading.Lock()
+
+
+def _get_agent(state):
+    """Return the shared agent instance for a state, or None if not processable."""
+    agent = _AGENTS.get(state)
+    if agent is not None:
+        return agent
+    agent_class = _AGENT_CLASSES.get(state)
+    if agent_class is None:
+        return None
+    with _agents_lock:
+        agent = _AGENTS.get(state)
+        if agent is None:
+            agent = _AGENTS[state] = agent_class()
+        return agent
+
 
 class WorkflowEngine:
     """
@@ -36,33 +98,61 @@ class WorkflowEngine:
     and runs the appropriate agent for each.
     """
 
-    def __init__(self):
-        # Map: current_state → agent instance
-        self.agents = {
-            'NEW':              EmailParserAgent(),
-            'PARSED':           ScamFilterAgent(),
-            'ANALYZED':         ClassificationAgent(),
-            'CLASSIFIED':       RequirementsAnalysisAgent(),
-            'REQUIREMENTS_ANALYZED': EstimationAgent(),
-            'ESTIMATION_READY': OfferGeneratorAgent(),
-            'NEGOTIATION':      DialogueOrchestratorAgent(),
-        }
+    # Query texts are constant: state lists and the keyset cursor are bound
+    # as parameters instead of being formatted into the SQL every cycle
+    _FETCH_AUTO_SQL = f"""
+        {_PROJECT_SELECT}
+        WHERE p.current_state = ANY(%(states)s::text[])
+          AND (%(after_created_at)s::timestamp IS NULL
+               OR (p.created_at, p.id) > (%(after_created_at)s, %(after_id)s))
+        ORDER BY p.created_at ASC, p.id ASC
+        LIMIT %(limit)s
+    """
+
+    _FETCH_EVENT_SQL = f"""
+        {_PROJECT_SELECT}
+        WHERE p.current_state = ANY(%(states)s::text[])
+          AND EXISTS (
+              SELECT 1 FROM project_messages pm
+              WHERE pm.project_id = p.id
+                AND pm.direction = 'inbound' AND pm.is_processed = FALSE
+          )
+        ORDER BY p.created_at ASC
+        LIMIT 10
+    """
+
+    def __init__(self, stop_event=None, wakeups=None):
         self.running = False
+        # Set by stop(); loops wait on it instead of sleeping, so shutdown is prompt
+        self._stop = stop_event or threading.Event()
+        # Bounded queue of wake-up signals (one per stored email) from the mail
+        # worker; without one the engine just polls every process_interval
+        self._wakeups = wakeups
         self.process_interval = 15  # seconds between processing cycles
-        self._lock = threading.Lock()
+        self.batch_size = 20  # max auto-state projects fetched per cycle
+        # Keyset cursor (created_at, id) of the last auto-state project fetched.
+        # Next cycle continues after it, so a page of projects that stay in
+        # their state cannot starve newer ones; reset once the tail is reached.
+        self._last_seen_key = None
 
     def start(self):
         """Start the workflow processing loop in current thread"""
         self.running = True
-        print(f"[WorkflowEngine] Started. Processing states: {list(self.agents.keys())}")
-        print(f"[WorkflowEngine] Terminal states: {TERMINAL_STATES}")
-        print(f"[WorkflowEngine] Manual states (no auto-processing): {MANUAL_STATES}")
+        log.info("[WorkflowEngine] Started. Processing states: %s", list(_AGENT_CLASSES))
+        log.info("[WorkflowEngine] Terminal states: %s", TERMINAL_STATES)
+        log.info("[WorkflowEngine] Manual states (no auto-processing): %s", MANUAL_STATES)
         self._process_loop()
 
     def stop(self):
         """Stop the workflow processing"""
         self.running = False
-        print("[WorkflowEngine] Stopped")
+        self._stop.set()
+        if self._wakeups is not None:
+            try:
+                self._wakeups.put_nowait(None)  # unblock _wait_for_work
+            except queue.Full:
+                pass  # a full queue doesn't block the waiter anyway
+        log.info("[WorkflowEngine] Stopped")
 
     def _process_loop(self):
         """Main processing loop"""
@@ -70,68 +160,68 @@ class WorkflowEngine:
             try:
                 processed = self._process_pending_projects()
                 if processed > 0:
-                    print(f"[WorkflowEngine] Processed {processed} project(s)")
+                    log.info("[WorkflowEngine] Processed %s project(s)", processed)
             except Exception as e:
-                print(f"[WorkflowEngine] Error in processing loop: {e}")
-            time.sleep(self.process_interval)
+                log.error("[WorkflowEngine] Error in processing loop: %s", e)
+            self._wait_for_work()
+
+    def _wait_for_work(self):
+        """
+        Sleep until the mail worker reports new work or process_interval passes.
+        Signals carry no data — each cycle queries the DB for work anyway.
+        At most one batch worth is consumed per cycle, so the bounded queue
+        tracks the real backlog and pushes back on mail intake.
+        """
+        if self._wakeups is None:
+            self._stop.wait(self.process_interval)
+            return
+        try:
+            self._wakeups.get(timeout=self.process_interval)
+        except queue.Empty:
+            return
+        for _ in range(self.batch_size - 1):
+            try:
+                self._wakeups.get_nowait()
+            except queue.Empty:
+                break
 
     def _process_pending_projects(self):
         """Find and process all projects in processable states"""
-        processable_states = list(self.agents.keys())
         processed_count = 0
 
-        # Separate states that always auto-process from states that need triggers
-        auto_states = [s for s in processable_states if s != 'NEGOTIATION']
-        event_states = [s for s in processable_states if s == 'NEGOTIATION']
-
         try:
+            after_created_at, after_id = self._last_seen_key or (None, None)
             with Database.get_cursor() as cursor:
-                # Get projects in auto-processable states
-                all_projects = []
-                if auto_states:
-                    placeholders = ', '.join(['%s'] * len(auto_states))
-                    cursor.execute(f"""
-                        SELECT id, current_state, client_email, title, description, 
-                               tech_stack, budget_min, budget_max, complexity,
-                               estimated_hours, quoted_price, source
-                        FROM projects
-                        WHERE current_state IN ({placeholders})
-                        ORDER BY created_at ASC
-                        LIMIT 20
-                    """, tuple(auto_states))
-                    all_projects.extend(cursor.fetchall())
+                # One page of projects in auto-processable states (LIMIT batch_size,
+                # so a plain fetch — a server-side cursor would only add round-trips)
+                cursor.execute(self._FETCH_AUTO_SQL, {
+                    'states': _AUTO_STATES,
+                    'after_created_at': after_created_at,
+                    'after_id': after_id,
+                    'limit': self.batch_size,
+                })
+                all_projects = cursor.fetchall()
 
                 # Only fetch NEGOTIATION projects that have unprocessed inbound messages
-                if event_states:
-                    cursor.execute("""
-                        SELECT p.id, p.current_state, p.client_email, p.title, 
-                               p.description, p.tech_stack, p.budget_min, p.budget_max, 
-                               p.complexity, p.estimated_hours, p.quoted_price,
-                               p.source, p.created_at
-                        FROM projects p
-                        WHERE p.current_state = 'NEGOTIATION'
-                          AND EXISTS (
-                              SELECT 1 FROM project_messages pm
-                              WHERE pm.project_id = p.id
-                                AND pm.direction = 'inbound' AND pm.is_processed = FALSE
-                          )
-                        ORDER BY p.created_at ASC
-                        LIMIT 10
-                    """)
-                    all_projects.extend(cursor.fetchall())
+                cursor.execute(self._FETCH_EVENT_SQL, {'states': _EVENT_STATES})
+                event_projects = cursor.fetchall()
+
+            if len(all_projects) < self.batch_size:
+                self._last_seen_key = None  # reached the tail — wrap around
+            else:
+                self._last_seen_key = (all_projects[-1]['created_at'], all_projects[-1]['id'])
+            all_projects.extend(event_projects)
 
             # Process each project (outside the cursor context)
             for project in all_projects:
                 if not self.running:
                     break
-                
-                with self._lock:
-                    success = self._process_single_project(project)
-                    if success:
-                        processed_count += 1
+
+                if self._process_single_project(project):
+                    processed_count += 1
 
         except Exception as e:
-            print(f"[WorkflowEngine] Error fetching projects: {e}")
+            log.error("[WorkflowEngine] Error fetching projects: %s", e)
 
         return processed_count
 
@@ -139,12 +229,12 @@ class WorkflowEngine:
         """Process a single project through its current agent"""
         project_id = project['id']
         current_state = project['current_state']
-        agent = self.agents.get(current_state)
+        agent = _get_agent(current_state)
 
         if not agent:
             return False
 
-        print(f"[WorkflowEngine] Processing project #{project_id} (state: {current_state}, agent: {agent.agent_name})")
+        log.info("[WorkflowEngine] Processing project #%s (state: %s, agent: %s)", project_id, current_state, agent.agent_name)
 
         try:
             # Run the agent
@@ -158,7 +248,7 @@ class WorkflowEngine:
                         WHERE id = %s
                     """, (new_state, project_id))
 
-                print(f"[WorkflowEngine] Project #{project_id}: {current_state} → {new_state}")
+                log.info("[WorkflowEngine] Project #%s: %s → %s", project_id, current_state, new_state)
 
                 # ── Telegram notifications on key transitions ──
                 self._notify_transition(project_id, current_state, new_state, project)
@@ -169,7 +259,7 @@ class WorkflowEngine:
                 return False
 
         except Exception as e:
-            print(f"[WorkflowEngine] Error processing project #{project_id}: {e}")
+            log.error("[WorkflowEngine] Error processing project #%s: %s", project_id, e)
             # Log the error
             try:
                 from app.database import QueryHelper
@@ -265,15 +355,15 @@ class WorkflowEngine:
                 tg.notify_agreed(project_id, title, price)
 
         except Exception as e:
-            print(f"[WorkflowEngine] Telegram notify error: {e}")
+            log.error("[WorkflowEngine] Telegram notify error: %s", e)
 
     def get_pipeline_info(self):
         """Return info about the workflow pipeline (for admin UI)"""
         return {
-            'states': list(self.agents.keys()),
+            'states': list(_AGENT_CLASSES),
             'terminal_states': list(TERMINAL_STATES),
             'manual_states': list(MANUAL_STATES),
-            'agents': {state: agent.agent_name for state, agent in self.agents.items()},
+            'agents': {state: _get_agent(state).agent_name for state in _AGENT_CLASSES},
             'pipeline': [
                 {'state': 'NEW', 'agent': 'email_parser_agent', 'description': 'Parse email, extract project details'},
                 {'state': 'PARSED', 'agent': 'scam_filter_agent', 'description': 'Check for scam/fraud/illegal'},
@@ -8,64 +8,228 @@ Handles:
 """
 import time
 import email
-import imaplib
+import hashlib
+import logging
+import queue
 import re
-from email.header import decode_header
+import select
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from email import policy
+from imapclient import IMAPClient
+from imapclient.exceptions import LoginError
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 from app.database import Database, QueryHelper
 from app.telegram_notifier import get_notifier
 from app.parsers.freelancer_parser import is_freelancer_digest, parse_digest
 from config import Config
 
+log = logging.getLogger(__name__)
+
 
 # ── DOMAIN FILTERING ──
 # ALLOWED_SENDER_DOMAINS from .env (comma-separated).  Use "*" to accept all.
 # BLOCKED_SENDER_DOMAINS — always rejected even when allowed = "*".
 _raw_allowed = getattr(Config, 'ALLOWED_SENDER_DOMAINS', '*')
 ALLOWED_SENDER_DOMAINS = (
-    [d.strip().lower() for d in _raw_allowed.split(',') if d.strip()]
-    if _raw_allowed and _raw_allowed.strip() != '*' else []
-)   # empty list = accept all
+    tuple(d.strip().lower() for d in _raw_allowed.split(',') if d.strip())
+    if _raw_allowed and _raw_allowed.strip() != '*' else ()
+)   # empty tuple = accept all
 
-BLOCKED_SENDER_DOMAINS = [
+BLOCKED_SENDER_DOMAINS = (
     'noreply', 'no-reply', 'mailer-daemon',
     'postmaster', 'bounce', 'donotreply',
-]
+)
+
+# Patterns used on every inbound email — compiled once at import
+_SENDER_RE = re.compile(r'<([^>]+)>')
+_RE_PREFIX = re.compile(r'^(Re:\s*)+', re.IGNORECASE)
+_BLOCKED_LOCAL_RE = re.compile('|'.join(re.escape(b) for b in BLOCKED_SENDER_DOMAINS))
+
+# ── SIZE LIMITS ──
+# Downstream code stores the body in a TEXT column and prompts with short
+# excerpts, so anything past these bounds only costs worker memory.
+MAX_MESSAGE_BYTES = 25 * 1024 * 1024  # whole message (RFC822.SIZE), not downloaded in full above this
+# Leading bytes fetched of a message over MAX_MESSAGE_BYTES: headers and the
+# text part come before attachments, so the inquiry itself still gets through
+PARTIAL_FETCH_BYTES = 1024 * 1024
+MAX_BODY_CHARS = 256 * 1024  # decoded body kept per message
+
+# DB errors worth retrying a message for (connection lost, pool exhausted);
+# anything else — e.g. DataError — fails the same way every time
+_TRANSIENT_DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pg_pool.PoolError)
+
+
+def _header(message, name):
+    """
+    Header value as str ('' if absent). policy.default parses headers on
+    access, and some malformed ones (e.g. "From: a@[") raise there — treat
+    them as empty rather than letting one bad message stop intake.
+    """
+    try:
+        return str(message.get(name, ''))
+    except Exception:
+        return ''
 
 
 class MailWorker:
-    def __init__(self):
+    def __init__(self, stop_event=None, wakeups=None):
         self.running = False
-        self.check_interval = 30  # seconds
+        # Set by stop(); waits use it instead of time.sleep, so shutdown is prompt
+        self._stop = stop_event or threading.Event()
+        # Bounded queue of wake-up signals to the workflow engine; a full
+        # queue slows intake until the engine catches up
+        self._wakeups = wakeups
+        self.wakeup_timeout = 30  # seconds to wait for room before giving up
+        self._wakeups_full = False  # after a timed-out put, don't block again until one fits
+        self.stop_poll = 1  # seconds; max delay for blocking IMAP / LISTEN waits to notice stop()
+        self.check_interval = 30  # seconds (IMAP polling fallback / retry delay)
+        self.outbound_backstop = 300  # seconds; drain outbox even without NOTIFY
+        self.idle_timeout = 29 * 60  # re-issue IDLE before the RFC 2177 30-min cutoff
+        self.max_backoff = 300  # seconds between IMAP reconnect attempts
         self._imap_failed = False  # suppress repeated IMAP error logs
         self._smtp_failed = False  # suppress repeated SMTP error logs
+        self.batch_size = 20  # new messages handled per scan
+        self.header_chunk = 50  # UIDs per header FETCH while looking for new mail
+        self.max_retries = 10  # attempts per message on transient DB errors, then skip
+        self._retries = {}  # uid -> failed attempts (transient DB errors)
+        self.handler_threads = 4  # parallel _handle_email workers (DB / Telegram I/O)
+        self.fetch_chunk = 10  # max bodies per FETCH; handling overlaps the next FETCH
+        self.fetch_chunk_bytes = 4 * 1024 * 1024  # cap on one FETCH response (by RFC822.SIZE)
+        self._last_uid = None  # highest INBOX UID already handled
+        self._outbound_thread = None  # survives an intake restart by the scheduler
+        # Recently handled Message-IDs as 64-bit hashes, bounded FIFO
+        # (deque order + set lookup)
+        self.processed_ids_limit = 10_000
+        self._processed_ids = set()
+        self._processed_order = deque()
+        self._processed_lock = threading.Lock()  # written from handler threads
+        self._processed_primed = False
 
     def start(self):
-        """Start the mail intake loop"""
+        """Start the mail intake loop (outbound sending runs on its own thread)"""
         self.running = True
-        print("[MailWorker] Started")
+        log.info("[MailWorker] Started")
+        if self._outbound_thread is None or not self._outbound_thread.is_alive():
+            self._outbound_thread = threading.Thread(target=self._outbound_loop,
+                                                     name='mail-outbound', daemon=True)
+            self._outbound_thread.start()
         self._intake_loop()
 
     def stop(self):
         self.running = False
-        print("[MailWorker] Stopped")
+        self._stop.set()
+        log.info("[MailWorker] Stopped")
+
+    def join(self, timeout=None):
+        """Wait for the outbound thread to finish its current send."""
+        if self._outbound_thread is not None:
+            self._outbound_thread.join(timeout)
+
+    def _outbound_loop(self):
+        """
+        Drain pending outbound messages independently of IMAP intake.
+        Wakes on NOTIFY email_pending (trigger on outbound inserts), with a
+        periodic drain as a backstop for missed notifications.
+        """
+        listener = None
+        while self.running:
+            self._send_pending_emails()
+            try:
+                if listener is None or listener.closed:
+                    listener = Database.listen('email_pending')
+                deadline = time.time() + self.outbound_backstop
+                while self.running and time.time() < deadline:
+                    if select.select([listener], [], [], self.stop_poll)[0]:
+                        listener.poll()
+                        listener.notifies.clear()  # one drain covers every pending row
+                        break
+            except Exception as e:
+                log.warning("[MailWorker] LISTEN email_pending failed: %s", e)
+                if listener is not None:
+                    listener.close()
+                listener = None
+                self._stop.wait(self.check_interval)
 
     def _intake_loop(self):
+        """Keep one IMAP session open; reconnect with exponential backoff on failure."""
+        backoff = self.check_interval
         while self.running:
+            # Check if email credentials are configured
+            mail_user = self._get_mail_username()
+            mail_pass = self._get_mail_password()
+
+            if not (mail_user and mail_pass and not self._is_placeholder(mail_user)):
+                if not self._imap_failed:
+                    log.warning("[MailWorker] Email credentials not configured or placeholder — skipping")
+                    self._imap_failed = True
+                self._stop.wait(self.check_interval)
+                continue
+
             try:
-                # Check if email credentials are configured
-                mail_user = self._get_mail_username()
-                mail_pass = self._get_mail_password()
-                
-                if mail_user and mail_pass and not self._is_placeholder(mail_user):
-                    self._process_new_emails(mail_user, mail_pass)
-                    self._send_pending_emails()
-                elif not self._imap_failed:
-                    print("[MailWorker] Email credentials not configured or placeholder — skipping")
+                self._run_imap_session(mail_user, mail_pass)
+                backoff = self.check_interval
+            except LoginError as e:
+                # Bad credentials won't fix themselves; don't hammer the provider
+                if not self._imap_failed:
+                    log.error("[MailWorker] IMAP login rejected: %s", e)
                     self._imap_failed = True
+                self._stop.wait(self.max_backoff)
             except Exception as e:
-                print(f"[MailWorker] Error: {e}")
-            
-            time.sleep(self.check_interval)
+                if not self._imap_failed:
+                    # A working session dropped — reconnect promptly
+                    log.error("[MailWorker] IMAP error: %s", e)
+                    self._imap_failed = True
+                    backoff = self.check_interval
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _run_imap_session(self, mail_user, mail_pass):
+        """
+        Process mail over a single long-lived IMAP connection.
+        Waits for new mail with IDLE (push) when the server supports it,
+        otherwise falls back to polling every check_interval.
+        """
+        mail = IMAPClient(Config.MAIL_HOST, port=Config.MAIL_PORT,
+                          ssl=Config.MAIL_USE_SSL, timeout=60)
+        try:
+            mail.login(mail_user, mail_pass)
+            folder = mail.select_folder('INBOX')
+            self._load_uid_state(folder.get(b'UIDVALIDITY'))
+            self._imap_failed = False  # reset on success
+            can_idle = mail.has_capability('IDLE')
+
+            while self.running:
+                if self._process_new_emails(mail):
+                    continue  # batch was capped — more mail already waiting
+                if can_idle:
+                    self._wait_for_mail(mail)
+                else:
+                    self._stop.wait(self.check_interval)
+        finally:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+    def _wait_for_mail(self, mail):
+        """IDLE until the server reports new mail or idle_timeout elapses."""
+        deadline = time.time() + self.idle_timeout
+        mail.idle()
+        try:
+            while self.running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                # Short checks so stop() is noticed without waiting out the full IDLE
+                responses = mail.idle_check(timeout=min(remaining, self.stop_poll))
+                if any(len(r) > 1 and r[1] in (b'EXISTS', b'RECENT') for r in responses):
+                    return
+        finally:
+            mail.idle_done()
 
     @staticmethod
     def _is_placeholder(value):
@@ -87,73 +251,249 @@ class MailWorker:
         except Exception:
             return Config.MAIL_PASSWORD
 
-    def _process_new_emails(self, mail_user, mail_pass):
-        """Connect to IMAP and process new emails"""
+    def _load_uid_state(self, uid_validity):
+        """
+        Restore the last handled UID from system_settings.
+        UIDs are only meaningful within one UIDVALIDITY; if the server
+        reset it, start over from the 7-day window.
+        """
         try:
-            mail = imaplib.IMAP4_SSL(Config.MAIL_HOST, Config.MAIL_PORT)
-            mail.login(mail_user, mail_pass)
-            mail.select('inbox')
-            self._imap_failed = False  # reset on success
+            stored_validity = QueryHelper.get_system_setting('mail_uidvalidity')
+            if uid_validity is not None and stored_validity != int(uid_validity):
+                QueryHelper.set_system_setting('mail_uidvalidity', int(uid_validity), 'integer')
+                QueryHelper.set_system_setting('mail_last_uid', 0, 'integer')
+                self._last_uid = None
+            else:
+                self._last_uid = QueryHelper.get_system_setting('mail_last_uid') or None
+        except Exception as e:
+            log.warning("[MailWorker] Could not load UID state: %s", e)
+            self._last_uid = None
 
-            # Only fetch emails from last 7 days to avoid processing ancient mail
+    def _save_last_uid(self, uid):
+        self._last_uid = uid
+        try:
+            QueryHelper.set_system_setting('mail_last_uid', uid, 'integer')
+        except Exception as e:
+            log.warning("[MailWorker] Could not persist last UID %s: %s", uid, e)
+
+    def _process_new_emails(self, mail):
+        """
+        Process mail that arrived after the last handled UID.
+        Returns True if the batch was capped and more mail is waiting.
+        """
+        if self._last_uid:
+            uids = [u for u in mail.search(['UID', f'{self._last_uid + 1}:*'])
+                    if u > self._last_uid]  # "n:*" always matches the newest UID
+        else:
+            # First run (or UIDVALIDITY reset): only the last 7 days
             # Use SINCE (not UNSEEN) — emails may be read in browser/phone
-            from datetime import datetime, timedelta
-            since_date = (datetime.now() - timedelta(days=7)).strftime('%d-%b-%Y')
-            status, messages = mail.search(None, f'(SINCE {since_date})')
-            if status != 'OK':
-                mail.logout()
-                return
-
-            msg_ids = messages[0].split()
-            if not msg_ids:
-                mail.logout()
-                return
-
-            # Limit to 20 emails per cycle to avoid overload
-            msg_ids = msg_ids[:20]
-
-            # Filter out already-processed emails by Message-ID
-            processed_ids = self._get_processed_message_ids()
+            from datetime import date, timedelta
+            uids = mail.search(['SINCE', date.today() - timedelta(days=7)])
+        if not uids:
+            return False
 
-            created = 0
-            skipped = 0
-            for msg_id in msg_ids:
+        uids = sorted(uids)
+
+        if not self._processed_primed:
+            self._prime_processed_ids()
+
+        # Headers in chunked multi-UID FETCHes — skip known Message-IDs without
+        # pulling bodies, and stop once a batch of new mail is found. The cap
+        # applies after dedup, so already-stored mail never fills the batch.
+        # BODY.PEEK leaves the \Seen flag untouched.
+        new_uids = []
+        sizes = {}
+        partial = set()  # oversized — only the first PARTIAL_FETCH_BYTES are fetched
+        scanned = 0  # uids[:scanned] had their headers checked
+        while scanned < len(uids) and len(new_uids) < self.batch_size:
+            part = uids[scanned:scanned + self.header_chunk]
+            scanned += len(part)
+            for uid, data in mail.fetch(part, ['BODY.PEEK[HEADER]', 'RFC822.SIZE']).items():
+                sizes[uid] = data.get(b'RFC822.SIZE', 0)
+                if sizes[uid] > MAX_MESSAGE_BYTES:
+                    log.warning("[MailWorker] UID %s is %s bytes — fetching only the first %s",
+                                uid, sizes[uid], PARTIAL_FETCH_BYTES)
+                    sizes[uid] = PARTIAL_FETCH_BYTES
+                    partial.add(uid)
                 try:
-                    status, msg_data = mail.fetch(msg_id, '(RFC822)')
-                    if status == 'OK':
-                        email_message = email.message_from_bytes(msg_data[0][1])
-                        mid = email_message.get('Message-ID', '')
-                        if mid and mid in processed_ids:
-                            continue  # already processed
-                        was_created = self._handle_email(email_message)
-                        if was_created:
-                            created += 1
-                        else:
-                            skipped += 1
+                    header = email.message_from_bytes(data[b'BODY[HEADER]'], policy=policy.default)
+                    mid = _header(header, 'Message-ID')
                 except Exception as e:
-                    print(f"[MailWorker] Error processing email {msg_id}: {e}")
+                    log.error("[MailWorker] Error reading headers of UID %s: %s", uid, e)
+                    continue
+                if self._message_key(mid or f'uid:{uid}') not in self._processed_ids:
+                    new_uids.append(uid)
+        new_uids.sort()
+        checked = uids[:scanned]
+        if len(new_uids) > self.batch_size:
+            new_uids = new_uids[:self.batch_size]
+            checked = [u for u in checked if u <= new_uids[-1]]
+        more_pending = len(checked) < len(uids)
+
+        # Bodies are fetched in small chunks; each chunk is handed to the
+        # pool straight away, so handling overlaps the next FETCH round-trip.
+        # One sender's mail (an original and its reply, a run of digests)
+        # is chained so it is still handled in arrival order.
+        futures = []
+        last_by_sender = {}
+        with ThreadPoolExecutor(max_workers=self.handler_threads,
+                                thread_name_prefix='mail-handler') as pool:
+            for chunk in self._fetch_chunks(new_uids, sizes):
+                full = [uid for uid in chunk if uid not in partial]
+                messages = mail.fetch(full, ['BODY.PEEK[]']) if full else {}
+                messages.update(self._fetch_partial([uid for uid in chunk if uid in partial], mail))
+                for uid in chunk:
+                    data = messages.get(uid)
+                    if not data:
+                        continue
+                    try:
+                        email_message = email.message_from_bytes(data[b'BODY[]'], policy=policy.default)
+                        sender = _header(email_message, 'From').lower()  # '' chains unreadable senders
+                    except Exception as e:
+                        log.error("[MailWorker] Error parsing email UID %s: %s", uid, e)
+                        continue
+                    future = pool.submit(self._handle_in_order, last_by_sender.get(sender),
+                                         uid, email_message)
+                    last_by_sender[sender] = future
+                    futures.append(future)
+        results = [f.result() for f in futures]
+
+        created = sum(1 for _, _, ok in results if ok is True)
+        skipped = sum(1 for _, _, ok in results if ok is False)
+        failed = [uid for uid, _, ok in results if ok is None]
+        if failed:
+            # Advance only past the UIDs before the first failure; the rest is
+            # fetched again, and messages already stored are skipped by the
+            # dedup set at the header check
+            done = [uid for uid in checked if uid < min(failed)]
+            if done:
+                self._save_last_uid(done[-1])
+            # Back off like a reconnect; a long outage still ends in a skip
+            # after max_retries (see _handle_in_order)
+            attempts = max(self._retries.get(uid, 1) for uid in failed)
+            delay = min(self.check_interval * 2 ** (attempts - 1), self.max_backoff)
+            log.warning("[MailWorker] %s message(s) not stored — retrying in %ss",
+                        len(failed), delay)
+            self._stop.wait(delay)
+            more_pending = True
+        else:
+            self._save_last_uid(checked[-1])
+        self._retries = {uid: n for uid, n in self._retries.items() if uid > (self._last_uid or 0)}
 
-            mail.logout()
-            if created > 0 or skipped > 0:
-                print(f"[MailWorker] Cycle done: {created} project(s) created, {skipped} skipped")
+        if created > 0 or skipped > 0:
+            log.info("[MailWorker] Cycle done: %s project(s) created, %s skipped", created, skipped)
+        return more_pending
 
+    @staticmethod
+    def _fetch_partial(uids, mail):
+        """
+        Fetch the first PARTIAL_FETCH_BYTES of each message, keyed like a full
+        BODY[] fetch. The cut-off tail (attachment data) just makes the MIME
+        parser record a defect; get_body() still finds the text part.
+        """
+        if not uids:
+            return {}
+        messages = {}
+        for uid, data in mail.fetch(uids, [f'BODY.PEEK[]<0.{PARTIAL_FETCH_BYTES}>']).items():
+            # Reported as BODY[]<0>
+            raw = next((v for k, v in data.items() if k.startswith(b'BODY[]')), None)
+            if raw is not None:
+                messages[uid] = {b'BODY[]': raw}
+        return messages
+
+    def _fetch_chunks(self, uids, sizes):
+        """
+        Group UIDs for body FETCHes: up to fetch_chunk messages, but no more
+        than fetch_chunk_bytes in total, so small mail needs few round-trips
+        and one FETCH response never holds several large attachments.
+        """
+        chunk, chunk_bytes = [], 0
+        for uid in uids:
+            size = sizes.get(uid, 0)
+            if chunk and (len(chunk) >= self.fetch_chunk
+                          or chunk_bytes + size > self.fetch_chunk_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(uid)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def _handle_in_order(self, previous, uid, email_message):
+        """
+        Handle one message on a pool thread, after the sender's previous one.
+        Returns (uid, message_id, result); result is None when the message
+        hit a transient DB error and must be retried, False when it was
+        skipped (filtered, malformed, rejected by the DB or out of retries).
+        """
+        if previous is not None:
+            wait([previous])  # submitted earlier, so already running or done
+            if previous.result()[2] is None:
+                # Keep the sender's order on retry (an original before its reply)
+                return uid, '', None
+        mid = ''
+        try:
+            mid = _header(email_message, 'Message-ID')
+            result = bool(self._handle_email(email_message))
+            if result:
+                # Stored — remember right away, so a retried batch skips it
+                # at the header check
+                self._remember_message_id(mid or f'uid:{uid}')
+                self._wake_engine()
+            return uid, mid, result
+        except _TRANSIENT_DB_ERRORS as e:
+            attempts = self._retries[uid] = self._retries.get(uid, 0) + 1
+            if attempts >= self.max_retries:
+                log.error("[MailWorker] Giving up on email UID %s after %s attempts: %s",
+                          uid, attempts, e)
+                return uid, mid, False
+            log.error("[MailWorker] Could not store email UID %s (attempt %s): %s", uid, attempts, e)
+            return uid, mid, None
+        except psycopg2.Error as e:
+            # Permanent (bad data, constraint): retrying would only stall intake
+            log.error("[MailWorker] Skipping email UID %s, DB rejected it: %s", uid, e)
+            return uid, mid, False
         except Exception as e:
-            if not self._imap_failed:
-                print(f"[MailWorker] IMAP error: {e}")
-                self._imap_failed = True
+            log.error("[MailWorker] Error processing email UID %s: %s", uid, e)
+            return uid, mid, False
 
-    def _get_processed_message_ids(self):
-        """Get set of Message-IDs already stored in project_messages (last 7 days)."""
+    def _prime_processed_ids(self):
+        """Load Message-IDs stored in project_messages (last 7 days) once per worker."""
         try:
             with Database.get_cursor() as cursor:
                 cursor.execute("""
                     SELECT message_id FROM project_messages
                     WHERE message_id IS NOT NULL
                       AND created_at > NOW() - INTERVAL '7 days'
-                """)
-                return {row['message_id'] for row in cursor.fetchall()}
-        except Exception:
-            return set()
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                """, (self.processed_ids_limit,))
+                rows = cursor.fetchall()
+        except Exception as e:
+            log.warning("[MailWorker] Could not load processed Message-IDs: %s", e)
+            return
+        for row in reversed(rows):  # oldest first, so they are evicted first
+            self._remember_message_id(row['message_id'])
+        self._processed_primed = True
+
+    @staticmethod
+    def _message_key(message_id):
+        """64-bit hash of a Message-ID: a small int instead of a ~100-byte string."""
+        return int.from_bytes(hashlib.blake2b(message_id.encode('utf-8', 'surrogateescape'),
+                                              digest_size=8).digest(), 'big')
+
+    def _remember_message_id(self, message_id):
+        """Add a Message-ID to the dedup set, evicting the oldest past the limit."""
+        if not message_id:
+            return
+        key = self._message_key(message_id)
+        with self._processed_lock:
+            if key in self._processed_ids:
+                return
+            self._processed_ids.add(key)
+            self._processed_order.append(key)
+            while len(self._processed_order) > self.processed_ids_limit:
+                self._processed_ids.discard(self._processed_order.popleft())
 
     @staticmethod
     def _is_bulk_email(email_message):
@@ -174,33 +514,43 @@ class MailWorker:
 
     def _handle_email(self, email_message):
         """Decide if email is a new project or a reply to existing. Returns True if project created."""
-        sender = email_message.get('From', '')
-        subject = self._decode_header(email_message.get('Subject', ''))
+        # policy.default already decodes RFC 2047 headers; _header() returns plain str
+        sender = _header(email_message, 'From')
+        subject = _header(email_message, 'Subject')
         body = self._get_email_body(email_message)
-        message_id = email_message.get('Message-ID', '')
-        in_reply_to = email_message.get('In-Reply-To', '')
+        message_id = _header(email_message, 'Message-ID')
+        in_reply_to = _header(email_message, 'In-Reply-To')
+        references = _header(email_message, 'References')
 
         # Extract email address from sender
-        email_match = re.search(r'<([^>]+)>', sender)
+        email_match = _SENDER_RE.search(sender)
         client_email = email_match.group(1) if email_match else sender.strip()
 
+        # Fit the VARCHAR columns these end up in (sender_email / message_id /
+        # in_reply_to 255, subject / title 500)
+        client_email = client_email[:255]
+        subject = subject[:500]
+        message_id = message_id[:255]
+        in_reply_to = in_reply_to[:255]
+
         # ── Freelancer.com digest: check BEFORE blocklist ──
         # (digests come from noreply@notifications.freelancer.com)
         if is_freelancer_digest(subject, body):
             return self._handle_freelancer_digest(body, message_id)
 
         # ── DOMAIN FILTERING ──
-        sender_local = client_email.split('@')[0].lower() if '@' in client_email else ''
-        sender_domain = client_email.split('@')[-1].lower() if '@' in client_email else ''
+        sender_local, at, sender_domain = client_email.lower().rpartition('@')
+        if not at:
+            sender_domain = ''
 
         # Always block known automated / noreply addresses
-        if any(b in sender_local for b in BLOCKED_SENDER_DOMAINS):
+        if _BLOCKED_LOCAL_RE.search(sender_local):
             return False
 
         # Whitelist check (empty list = accept all)
         is_whitelisted = True
         if ALLOWED_SENDER_DOMAINS:
-            if not any(sender_domain.endswith(d) for d in ALLOWED_SENDER_DOMAINS):
+            if not sender_domain.endswith(ALLOWED_SENDER_DOMAINS):
                 return False  # domain not in whitelist
         # If we reached here, the sender is allowed
 
@@ -209,12 +559,12 @@ class MailWorker:
             return False
 
         # Check if this is a reply to an existing project
-        existing_project_id = self._find_existing_project(in_reply_to, subject, client_email)
+        existing_project_id = self._find_existing_project(in_reply_to, subject, client_email, references)
 
         if existing_project_id:
             # Add as inbound message to existing project
             self._add_message_to_project(existing_project_id, client_email, subject, body, message_id, in_reply_to)
-            print(f"[MailWorker] Added reply to project #{existing_project_id}")
+            log.info("[MailWorker] Added reply to project #%s", existing_project_id)
 
             # If project is in OFFER_SENT state, move to NEGOTIATION
             self._check_offer_response(existing_project_id, body)
@@ -227,133 +577,128 @@ class MailWorker:
             self._create_project_from_email(client_email, subject, body, message_id)
             return True
 
-    def _find_existing_project(self, in_reply_to, subject, client_email):
+    def _find_existing_project(self, in_reply_to, subject, client_email, references=''):
         """Try to find an existing project this email belongs to"""
-        try:
-            with Database.get_cursor() as cursor:
-                # Method 1: Match by In-Reply-To header
-                if in_reply_to:
-                    cursor.execute("""
-                        SELECT project_id FROM project_messages 
-                        WHERE message_id = %s LIMIT 1
-                    """, (in_reply_to,))
-                    result = cursor.fetchone()
-                    if result:
-                        return result['project_id']
-
-                # Method 2: Match by subject + client email (for active projects)
-                if subject and client_email:
-                    # Strip "Re:" prefixes
-                    clean_subject = re.sub(r'^(Re:\s*)+', '', subject, flags=re.IGNORECASE).strip()
-                    if clean_subject:
-                        cursor.execute("""
-                            SELECT p.id FROM projects p
-                            LEFT JOIN project_messages pm ON pm.project_id = p.id
-                            WHERE p.client_email = %s 
-                            AND p.current_state NOT IN ('CLOSED', 'REJECTED')
-                            AND (p.title ILIKE %s OR pm.subject ILIKE %s)
-                            ORDER BY p.updated_at DESC
-                            LIMIT 1
-                        """, (client_email, f'%{clean_subject}%', f'%{clean_subject}%'))
-                        result = cursor.fetchone()
-                        if result:
-                            return result['id']
-
-                # Method 3: Match freelancer.com projects by title
-                # (client from FL wrote to our email — project has no client_email yet)
-                if subject and client_email:
-                    clean_subject = re.sub(r'^(Re:\s*)+', '', subject, flags=re.IGNORECASE).strip()
-                    if clean_subject:
-                        cursor.execute("""
-                            SELECT id FROM projects
-                            WHERE source = 'freelancer.com'
-                              AND current_state NOT IN ('CLOSED', 'REJECTED')
-                              AND (client_email IS NULL OR client_email = '')
-                              AND title ILIKE %s
-                            ORDER BY updated_at DESC LIMIT 1
-                        """, (f'%{clean_subject}%',))
-                        result = cursor.fetchone()
-                        if result:
-                            # Link client email to this project
-                            cursor.execute("""
-                                UPDATE projects SET client_email = %s, updated_at = NOW()
-                                WHERE id = %s
-                            """, (client_email, result['id']))
-                            print(f"[MailWorker] Linked email {client_email} to FL project #{result['id']}")
-                            return result['id']
-
-        except Exception as e:
-            print(f"[MailWorker] Error finding existing project: {e}")
-
-        return None
+        # Every Message-ID of the thread: References lists all ancestors,
+        # In-Reply-To the direct parent (often the only one present)
+        thread_ids = list(dict.fromkeys(f"{references or ''} {in_reply_to or ''}".split()))
+        # Strip "Re:" prefixes; NULL disables the subject matches.
+        # subject_norm mirrors the title_norm / subject_norm generated columns,
+        # whose btrim() removes spaces only — so strip(' ') here, not strip().
+        clean_subject = _RE_PREFIX.sub('', subject or '')
+        subject_norm = (clean_subject.strip(' ').lower()
+                        if clean_subject.strip() and client_email else None)
+        pattern = f'%{clean_subject.strip()}%' if subject_norm else None
+        with Database.get_cursor() as cursor:
+            # One round-trip, methods in priority order:
+            # 1. References / In-Reply-To headers
+            # 2. Normalized subject + client email (active projects)
+            # 3. Freelancer.com project by title (client from FL wrote
+            #    to our email — project has no client_email yet)
+            cursor.execute("""
+                (SELECT project_id AS id, 1 AS rank FROM project_messages
+                 WHERE message_id = ANY(%(thread_ids)s) LIMIT 1)
+                UNION ALL
+                (SELECT p.id, 2 FROM projects p
+                 LEFT JOIN project_messages pm ON pm.project_id = p.id
+                 WHERE p.client_email = %(client_email)s
+                   AND p.current_state NOT IN ('CLOSED', 'REJECTED')
+                   AND (p.title_norm = %(subject_norm)s OR pm.subject_norm = %(subject_norm)s)
+                 ORDER BY p.updated_at DESC LIMIT 1)
+                UNION ALL
+                (SELECT id, 3 FROM projects
+                 WHERE source = 'freelancer.com'
+                   AND current_state NOT IN ('CLOSED', 'REJECTED')
+                   AND (client_email IS NULL OR client_email = '')
+                   AND title ILIKE %(pattern)s
+                 ORDER BY updated_at DESC LIMIT 1)
+                ORDER BY rank LIMIT 1
+            """, {'thread_ids': thread_ids, 'client_email': client_email,
+                  'subject_norm': subject_norm, 'pattern': pattern})
+            result = cursor.fetchone()
+            if not result:
+                return None
+
+            if result['rank'] == 3:
+                # Link client email to this project
+                cursor.execute("""
+                    UPDATE projects SET client_email = %s, updated_at = NOW()
+                    WHERE id = %s
+                """, (client_email, result['id']))
+                log.info("[MailWorker] Linked email %s to FL project #%s", client_email, result['id'])
+            return result['id']
 
     def _add_message_to_project(self, project_id, sender_email, subject, body, message_id, in_reply_to):
-        """Add an inbound message to an existing project"""
-        try:
-            with Database.get_cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO project_messages 
-                    (project_id, direction, sender_email, subject, body, message_id, in_reply_to, is_processed)
-                    VALUES (%s, 'inbound', %s, %s, %s, %s, %s, FALSE)
-                """, (project_id, sender_email, subject, body, message_id, in_reply_to))
-        except Exception as e:
-            print(f"[MailWorker] Error adding message: {e}")
+        """Add an inbound message to an existing project (DB errors propagate)"""
+        with Database.get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO project_messages 
+                (project_id, direction, sender_email, subject, body, message_id, in_reply_to, is_processed)
+                VALUES (%s, 'inbound', %s, %s, %s, %s, %s, FALSE)
+            """, (project_id, sender_email, subject, body, message_id, in_reply_to))
 
     def _check_offer_response(self, project_id, body=''):
         """If project is in OFFER_SENT, move to NEGOTIATION"""
         try:
             with Database.get_cursor() as cursor:
+                # Transition + audit row in one atomic statement
                 cursor.execute("""
-                    UPDATE projects SET current_state = 'NEGOTIATION', updated_at = NOW()
-                    WHERE id = %s AND current_state = 'OFFER_SENT'
-                """, (project_id,))
-                if cursor.rowcount > 0:
-                    cursor.execute("""
+                    WITH upd AS (
+                        UPDATE projects SET current_state = 'NEGOTIATION', updated_at = NOW()
+                        WHERE id = %s AND current_state = 'OFFER_SENT'
+                        RETURNING id, title, client_email
+                    ), ins AS (
                         INSERT INTO project_states (project_id, from_state, to_state, changed_by, reason)
-                        VALUES (%s, 'OFFER_SENT', 'NEGOTIATION', 'mail_worker', 'Client replied to offer')
-                    """, (project_id,))
-                    print(f"[MailWorker] Project #{project_id}: OFFER_SENT → NEGOTIATION (client replied)")
-
-                    # Notify owner: client replied!
-                    try:
-                        cursor.execute("SELECT title, client_email FROM projects WHERE id = %s", (project_id,))
-                        proj = cursor.fetchone()
-                        if proj:
-                            get_notifier().notify_client_reply(
-                                project_id, proj['title'], proj['client_email'], body[:200] if body else ''
-                            )
-                    except Exception:
-                        pass
+                        SELECT id, 'OFFER_SENT', 'NEGOTIATION', 'mail_worker', 'Client replied to offer'
+                        FROM upd
+                    )
+                    SELECT title, client_email FROM upd
+                """, (project_id,))
+                proj = cursor.fetchone()
         except Exception as e:
-            print(f"[MailWorker] Error updating project state: {e}")
+            log.error("[MailWorker] Error updating project state: %s", e)
+            return
+
+        if proj:
+            log.info("[MailWorker] Project #%s: OFFER_SENT → NEGOTIATION (client replied)", project_id)
+            # Notify owner: client replied!
+            try:
+                get_notifier().notify_client_reply(
+                    project_id, proj['title'], proj['client_email'], body[:200] if body else ''
+                )
+            except Exception:
+                pass
 
     def _check_clarification_response(self, project_id, body=''):
         """If project is in CLARIFICATION_NEEDED, client replied — re-analyse requirements."""
         try:
             with Database.get_cursor() as cursor:
                 cursor.execute("""
-                    UPDATE projects SET current_state = 'CLASSIFIED', updated_at = NOW()
-                    WHERE id = %s AND current_state = 'CLARIFICATION_NEEDED'
-                """, (project_id,))
-                if cursor.rowcount > 0:
-                    cursor.execute("""
+                    WITH upd AS (
+                        UPDATE projects SET current_state = 'CLASSIFIED', updated_at = NOW()
+                        WHERE id = %s AND current_state = 'CLARIFICATION_NEEDED'
+                        RETURNING id, title, client_email
+                    ), ins AS (
                         INSERT INTO project_states (project_id, from_state, to_state, changed_by, reason)
-                        VALUES (%s, 'CLARIFICATION_NEEDED', 'CLASSIFIED', 'mail_worker',
-                                'Client replied to clarification questions — re-analysing')
-                    """, (project_id,))
-                    print(f"[MailWorker] Project #{project_id}: CLARIFICATION_NEEDED → CLASSIFIED (client replied)")
-
-                    try:
-                        cursor.execute("SELECT title, client_email FROM projects WHERE id = %s", (project_id,))
-                        proj = cursor.fetchone()
-                        if proj:
-                            get_notifier().notify_client_reply(
-                                project_id, proj['title'], proj['client_email'], body[:200] if body else ''
-                            )
-                    except Exception:
-                        pass
+                        SELECT id, 'CLARIFICATION_NEEDED', 'CLASSIFIED', 'mail_worker',
+                               'Client replied to clarification questions — re-analysing'
+                        FROM upd
+                    )
+                    SELECT title, client_email FROM upd
+                """, (project_id,))
+                proj = cursor.fetchone()
         except Exception as e:
-            print(f"[MailWorker] Error checking clarification response: {e}")
+            log.error("[MailWorker] Error checking clarification response: %s", e)
+            return
+
+        if proj:
+            log.info("[MailWorker] Project #%s: CLARIFICATION_NEEDED → CLASSIFIED (client replied)", project_id)
+            try:
+                get_notifier().notify_client_reply(
+                    project_id, proj['title'], proj['client_email'], body[:200] if body else ''
+                )
+            except Exception:
+                pass
 
     def _handle_freelancer_digest(self, body, message_id):
         """Parse a freelancer.com digest email and create multiple projects."""
@@ -361,148 +706,166 @@ class MailWorker:
         if not projects:
             return False
 
-        created = 0
+        # Prepare rows; a digest can list the same job twice — keep the first
+        items = {}
         for proj in projects:
+            # Truncate title to 490 chars (DB column is VARCHAR(500))
+            proj['title'] = (proj['title'] or 'Untitled')[:490]
+            if proj['title'] in items:
+                continue
+
+            # Create project directly in PARSED state (data already structured)
+            budget_note = f"Budget: {proj['budget_raw']}"
+            if proj['is_hourly']:
+                budget_note += ' (hourly rate)'
+
+            proj['full_desc'] = (
+                f"{proj['description']}\n\n"
+                f"Skills: {', '.join(proj['tech_stack'])}\n"
+                f"{budget_note}\n"
+                f"URL: {proj['freelancer_url']}"
+            )
+            proj['budget_note'] = budget_note
+            items[proj['title']] = proj
+
+        # One transaction: a DB error rolls back the whole digest and propagates,
+        # so the message is retried instead of half-stored
+        with Database.get_cursor() as cursor:
+            # Duplicate check: same title from freelancer.com in last 48h
+            cursor.execute("""
+                SELECT title FROM projects
+                WHERE title = ANY(%s) AND source = 'freelancer.com'
+                  AND created_at > NOW() - INTERVAL '48 hours'
+            """, (list(items),))
+            for row in cursor.fetchall():
+                items.pop(row['title'], None)
+            if not items:
+                return False
+
+            inserted = execute_values(cursor, """
+                INSERT INTO projects (
+                    title, description, budget_min, budget_max,
+                    tech_stack, category, current_state, source,
+                    requirements_doc, created_at, updated_at
+                ) VALUES %s
+                RETURNING id, title
+            """, [
+                (p['title'], p['full_desc'], p['budget_min'], p['budget_max'],
+                 p['tech_stack'], p['category'], p['freelancer_url'])
+                for p in items.values()
+            ], template="(%s, %s, %s::numeric, %s::numeric, %s::text[], %s, "
+                        "'PARSED', 'freelancer.com', %s, NOW(), NOW())",
+               fetch=True)
+            ids = {row['title']: row['id'] for row in inserted}
+
+            # Store listings as inbound messages (already processed — no AI parse needed)
+            execute_values(cursor, """
+                INSERT INTO project_messages
+                (project_id, direction, sender_email, subject, body, message_id, is_processed)
+                VALUES %s
+            """, [
+                (ids[t], t, p['full_desc'], message_id) for t, p in items.items()
+            ], template="(%s, 'inbound', 'noreply@notifications.freelancer.com', %s, %s, %s, TRUE)")
+
+            # Log state transitions
+            execute_values(cursor, """
+                INSERT INTO project_states (project_id, from_state, to_state, changed_by, reason)
+                VALUES %s
+            """, [
+                (ids[t], p['budget_note']) for t, p in items.items()
+            ], template="(%s, 'NEW', 'PARSED', 'freelancer_parser', %s)")
+
+        notifier = get_notifier()
+        for title, proj in items.items():
+            project_id = ids[title]
+            log.info("[MailWorker] Freelancer #%s: %s", project_id, title[:60])
+
+            # Telegram notification
+            desc_with_budget = (
+                f"💵 {proj['budget_raw']}\n"
+                f"🛠 {', '.join(proj['tech_stack'][:5])}\n\n"
+                f"{proj['description'][:250]}"
+            )
             try:
-                # Truncate title to 490 chars (DB column is VARCHAR(500))
-                proj['title'] = (proj['title'] or 'Untitled')[:490]
-
-                with Database.get_cursor() as cursor:
-                    # Duplicate check: same title from freelancer.com in last 48h
-                    cursor.execute("""
-                        SELECT id FROM projects
-                        WHERE title = %s AND source = 'freelancer.com'
-                          AND created_at > NOW() - INTERVAL '48 hours'
-                    """, (proj['title'],))
-                    if cursor.fetchone():
-                        continue  # skip duplicate
-
-                    # Create project directly in PARSED state (data already structured)
-                    budget_note = f"Budget: {proj['budget_raw']}"
-                    if proj['is_hourly']:
-                        budget_note += ' (hourly rate)'
-
-                    full_desc = (
-                        f"{proj['description']}\n\n"
-                        f"Skills: {', '.join(proj['tech_stack'])}\n"
-                        f"{budget_note}\n"
-                        f"URL: {proj['freelancer_url']}"
-                    )
-
-                    cursor.execute("""
-                        INSERT INTO projects (
-                            title, description, budget_min, budget_max,
-                            tech_stack, category, current_state, source,
-                            requirements_doc, created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, 'PARSED', 'freelancer.com',
-                                  %s, NOW(), NOW())
-                        RETURNING id
-                    """, (
-                        proj['title'],
-                        full_desc,
-                        proj['budget_min'],
-                        proj['budget_max'],
-                        proj['tech_stack'],
-                        proj['category'],
-                        proj['freelancer_url']
-                    ))
-                    project_id = cursor.fetchone()['id']
-
-                    # Store listing as inbound message (already processed — no AI parse needed)
-                    cursor.execute("""
-                        INSERT INTO project_messages
-                        (project_id, direction, sender_email, subject, body, message_id, is_processed)
-                        VALUES (%s, 'inbound', 'noreply@notifications.freelancer.com', %s, %s, %s, TRUE)
-                    """, (project_id, proj['title'], full_desc, message_id))
-
-                    # Log state transition
-                    cursor.execute("""
-                        INSERT INTO project_states (project_id, from_state, to_state, changed_by, reason)
-                        VALUES (%s, 'NEW', 'PARSED', 'freelancer_parser', %s)
-                    """, (project_id, budget_note))
-
-                print(f"[MailWorker] Freelancer #{project_id}: {proj['title'][:60]}")
-
-                # Telegram notification
-                desc_with_budget = (
-                    f"💵 {proj['budget_raw']}\n"
-                    f"🛠 {', '.join(proj['tech_stack'][:5])}\n\n"
-                    f"{proj['description'][:250]}"
-                )
-                get_notifier().notify_new_project(
-                    project_id, proj['title'],
+                notifier.notify_new_project(
+                    project_id, title,
                     proj['freelancer_url'], desc_with_budget
                 )
-
-                created += 1
             except Exception as e:
-                print(f"[MailWorker] Error creating freelancer project: {e}")
-
-        if created > 0:
-            print(f"[MailWorker] Created {created} freelancer project(s) from digest")
-
-        return created > 0
+                log.warning("[MailWorker] Notification failed for project #%s: %s", project_id, e)
+
+        log.info("[MailWorker] Created %s freelancer project(s) from digest", len(items))
+        return True
+
+    def _wake_engine(self):
+        """
+        Signal the workflow engine once per stored email. Blocks (up to
+        wakeup_timeout) while the engine is far behind; once a put has timed
+        out, later signals are dropped without waiting until one fits again —
+        the mail is already stored and the engine's poll will reach it.
+        """
+        if self._wakeups is None:
+            return
+        try:
+            if self._wakeups_full:
+                self._wakeups.put_nowait(True)
+            else:
+                self._wakeups.put(True, timeout=self.wakeup_timeout)
+            self._wakeups_full = False
+        except queue.Full:
+            if not self._wakeups_full:
+                log.warning("[MailWorker] Workflow queue full — engine will pick up new mail on its next poll")
+            self._wakeups_full = True
 
     def _create_project_from_email(self, client_email, subject, body, message_id):
-        """Create a new project record from email data"""
+        """Create a new project record from email data (DB errors propagate)"""
+        # Ensure client exists
+        client_id = self._ensure_client(client_email)
+
+        title = subject.strip() if subject.strip() else body.split('\n')[0][:200] if body else 'Untitled Project'
+        if not title:
+            title = 'Untitled Project'
+
+        description = f"Subject: {subject}\n\n{body}" if subject else body
+
+        with Database.get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO projects (title, client_email, client_id, description, 
+                                     current_state, source, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, 'NEW', 'email', NOW(), NOW())
+                RETURNING id
+            """, (title, client_email, client_id, description))
+            project_id = cursor.fetchone()['id']
+
+            # Also store the original email as a message
+            cursor.execute("""
+                INSERT INTO project_messages 
+                (project_id, direction, sender_email, subject, body, message_id, is_processed)
+                VALUES (%s, 'inbound', %s, %s, %s, %s, FALSE)
+            """, (project_id, client_email, subject, body, message_id))
+
+        log.info("[MailWorker] Created project #%s: %s", project_id, title)
+
+        # Notify owner via Telegram — the project is stored, so a failure here
+        # must not make the message look unhandled
         try:
-            # Ensure client exists
-            client_id = self._ensure_client(client_email)
-
-            title = subject.strip() if subject.strip() else body.split('\n')[0][:200] if body else 'Untitled Project'
-            if not title:
-                title = 'Untitled Project'
-
-            description = f"Subject: {subject}\n\n{body}" if subject else body
-
-            with Database.get_cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO projects (title, client_email, client_id, description, 
-                                         current_state, source, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, 'NEW', 'email', NOW(), NOW())
-                    RETURNING id
-                """, (title, client_email, client_id, description))
-                project_id = cursor.fetchone()['id']
-
-                # Also store the original email as a message
-                cursor.execute("""
-                    INSERT INTO project_messages 
-                    (project_id, direction, sender_email, subject, body, message_id, is_processed)
-                    VALUES (%s, 'inbound', %s, %s, %s, %s, FALSE)
-                """, (project_id, client_email, subject, body, message_id))
-
-            print(f"[MailWorker] Created project #{project_id}: {title}")
-
-            # Notify owner via Telegram
             get_notifier().notify_new_project(project_id, title, client_email, description)
-
         except Exception as e:
-            print(f"[MailWorker] Error creating project: {e}")
+            log.warning("[MailWorker] Notification failed for project #%s: %s", project_id, e)
 
     def _ensure_client(self, email_addr):
         """Create client if not exists, return client_id"""
         try:
             with Database.get_cursor() as cursor:
-                cursor.execute("SELECT id FROM clients WHERE email = %s", (email_addr,))
-                result = cursor.fetchone()
-                if result:
-                    return result['id']
-
+                # No-op update on conflict so RETURNING yields the existing row too
                 cursor.execute("""
                     INSERT INTO clients (email) VALUES (%s)
-                    ON CONFLICT (email) DO NOTHING
+                    ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
                     RETURNING id
                 """, (email_addr,))
-                result = cursor.fetchone()
-                if result:
-                    return result['id']
-
-                # If ON CONFLICT hit, fetch again
-                cursor.execute("SELECT id FROM clients WHERE email = %s", (email_addr,))
-                result = cursor.fetchone()
-                return result['id'] if result else None
+                return cursor.fetchone()['id']
         except Exception as e:
-            print(f"[MailWorker] Error ensuring client: {e}")
+            log.error("[MailWorker] Error ensuring client: %s", e)
             return None
 
     def _send_pending_emails(self):
@@ -517,32 +880,31 @@ class MailWorker:
                 self._smtp_failed = False
         except Exception as e:
             if not self._smtp_failed:
-                print(f"[MailWorker] Error sending pending emails: {e}")
+                log.error("[MailWorker] Error sending pending emails: %s", e)
                 self._smtp_failed = True
 
-    def _decode_header(self, header):
-        if header:
-            decoded_parts = decode_header(header)
-            result = ''
-            for part, encoding in decoded_parts:
-                if isinstance(part, bytes):
-                    result += part.decode(encoding or 'utf-8', errors='ignore')
-                else:
-                    result += part
-            return result
-        return ""
-
     def _get_email_body(self, email_message):
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode('utf-8', errors='ignore')
-                    break
-        else:
-            payload = email_message.get_payload(decode=True)
-            if payload:
-                body = payload.decode('utf-8', errors='ignore')
-        return body
\ No newline at end of file
+        """Return the preferred inline body (text/plain, else text/html).
+        get_body() skips attachments and decodes with the declared charset."""
+        body_part = email_message.get_body(preferencelist=('plain', 'html'))
+        if body_part is None:
+            return ''
+        # Encoded size check: base64 / QP never shrink by more than ~4x, so a
+        # part this large overflows the cap — keep the leading MAX_BODY_CHARS
+        # instead of building the full decoded text
+        encoded = body_part.get_payload()
+        if isinstance(encoded, str) and len(encoded) > MAX_BODY_CHARS * 4:
+            log.warning("[MailWorker] Truncating oversized %s body (%s chars encoded)",
+                        body_part.get_content_type(), len(encoded))
+            payload = (body_part.get_payload(decode=True) or b'')[:MAX_BODY_CHARS * 4]
+            try:
+                text = payload.decode(body_part.get_content_charset() or 'utf-8', errors='ignore')
+            except LookupError:
+                text = payload.decode('utf-8', errors='ignore')
+            return text[:MAX_BODY_CHARS]
+        try:
+            return body_part.get_content()[:MAX_BODY_CHARS]
+        except LookupError:
+            # Unknown charset declared by the sender
+            payload = body_part.get_payload(decode=True) or b''
+            return payload[:MAX_BODY_CHARS].decode('utf-8', errors='ignore')
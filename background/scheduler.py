@@ -1,51 +1,158 @@
+import os
+import queue
 import time
 import threading
+from app.database import Database
 from app.workflow.engine import WorkflowEngine
 from background.mail_worker import MailWorker
+from config import Config
+
+# pg advisory lock key: only one process per database runs the background loops
+_LEADER_LOCK_ID = 7_240_517_301
 
 
 class BackgroundScheduler:
     def __init__(self):
-        self.workflow_engine = WorkflowEngine()
-        self.mail_worker = MailWorker()
+        self._stop = threading.Event()  # set by stop_all; ends leader election
+        # Mail → workflow wake-up signals, bounded so intake backs off when the engine lags
+        self._wakeups = queue.Queue(maxsize=512)
         self.threads = []
+        self.restart_delay = 30  # seconds before restarting a crashed loop
+        self.join_timeout = 5  # seconds stop_all waits for loops to finish
+        self.lock_retry = 30  # seconds between attempts to take the scheduler lock
+        self.leader_check = 30  # seconds between checks that the lock connection is alive
+        self._leader_conn = None  # holds the advisory lock while open
+        self._leader_thread = None
+        self._new_loops()
+
+    def _new_loops(self):
+        """Fresh loop instances for one term as leader, with their own stop event"""
+        self._loops_stop = threading.Event()
+        self.workflow_engine = WorkflowEngine(stop_event=self._loops_stop, wakeups=self._wakeups)
+        self.mail_worker = MailWorker(stop_event=self._loops_stop, wakeups=self._wakeups)
 
     def start_all(self):
-        """Start all background processes"""
-        print("Starting background scheduler...")
+        """
+        Start background processing. The loops run only in the process holding
+        the scheduler's advisory lock; the others keep retrying, so one takes
+        over if the leader goes away (or the DB was down at boot).
+        Returns False in the Werkzeug reloader parent, True otherwise.
+        """
+        # Werkzeug reloader parent: the app (and scheduler) runs in the child
+        if Config.DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+            return False
+        if self._leader_thread is None:
+            self._leader_thread = threading.Thread(target=self._lead, name='bg-leader', daemon=True)
+            self._leader_thread.start()
+        return True
 
-        # Start workflow engine
-        workflow_thread = threading.Thread(target=self._run_workflow_loop, daemon=True)
-        workflow_thread.start()
-        self.threads.append(workflow_thread)
+    def _lead(self):
+        """Take the lock (retrying), run the loops while it is held, repeat"""
+        standby_logged = False
+        while not self._stop.is_set():
+            # Single leader across processes (gunicorn workers, second instance...)
+            try:
+                self._leader_conn = Database.try_advisory_lock(_LEADER_LOCK_ID)
+            except Exception as e:
+                # Never start without the lock: two leaders would ingest the same mail twice
+                print(f"⚠️  Could not take scheduler lock ({e}) — retrying in {self.lock_retry}s")
+                self._leader_conn = None
+                self._stop.wait(self.lock_retry)
+                continue
+            if self._leader_conn is None:
+                if not standby_logged:
+                    print("Background scheduler running in another process — standing by")
+                    standby_logged = True
+                self._stop.wait(self.lock_retry)
+                continue
+            standby_logged = False
 
-        # Start mail intake
-        mail_thread = threading.Thread(target=self._run_mail_loop, daemon=True)
-        mail_thread.start()
-        self.threads.append(mail_thread)
+            self._start_loops()
+            while not self._stop.wait(self.leader_check):
+                if not self._lock_alive():
+                    print("⚠️  Scheduler lock connection lost — stopping background loops")
+                    break
+            self._stop_loops()
+            self._release_lock()
+            if not self._stop.is_set():
+                self._new_loops()
+
+    def _lock_alive(self):
+        """The advisory lock lives exactly as long as its session"""
+        try:
+            with self._leader_conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _release_lock(self):
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.close()  # releases the advisory lock
+            except Exception:
+                pass
+            self._leader_conn = None
+
+    def _start_loops(self):
+        print("Starting background scheduler...")
+
+        # Workflow engine and mail intake, each under a supervisor
+        for name, target in (('workflow', self.workflow_engine.start),
+                             ('mail', self.mail_worker.start)):
+            thread = threading.Thread(target=self._supervise,
+                                      args=(name, target, self._loops_stop),
+                                      name=f'bg-{name}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
 
         # NOTE: Freelancer.com inbox reader disabled — platform requires paid
         # verification to interact with projects; inbox messages are marketing only.
 
         print("Background scheduler started with workflow and mail processing")
 
-    def stop_all(self):
-        """Stop all background processes"""
+    def _stop_loops(self):
+        """Stop the loops of the current term"""
+        if not self.threads:
+            return
         print("Stopping background scheduler...")
+        self._loops_stop.set()
         self.workflow_engine.stop()
         self.mail_worker.stop()
+        # Let loops finish the current step (IMAP logout, DB commit) —
+        # bounded, so a hung call cannot block shutdown
+        deadline = time.time() + self.join_timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+        self.mail_worker.join(max(0, deadline - time.time()))
+        # Threads still busy after the timeout are daemon and die with the process
+        self.threads = []
+
+    def stop_all(self):
+        """Stop all background processes"""
+        if self._leader_thread is None:
+            return  # never started in this process
+        self._stop.set()
+        # The leader thread stops the loops and releases the lock
+        self._leader_thread.join(self.join_timeout + 1)
         # Close Selenium browser if it was used
         try:
             from app.freelancer_client import _shutdown_client
             _shutdown_client()
         except Exception:
             pass
-        # Threads are daemon, they will stop with main process
-
-    def _run_workflow_loop(self):
-        """Run workflow engine in a loop"""
-        self.workflow_engine.start()
 
-    def _run_mail_loop(self):
-        """Run mail worker in a loop"""
-        self.mail_worker.start()
\ No newline at end of file
+    def _supervise(self, name, target, stop):
+        """Run a background loop; if it crashes, report it and restart after a delay"""
+        while not stop.is_set():
+            try:
+                target()
+                return  # clean exit after stop()
+            except Exception as e:
+                print(f"⚠️  Background {name} loop crashed: {e!r} — restarting in {self.restart_delay}s")
+                try:
+                    from app.telegram_notifier import get_notifier
+                    get_notifier().notify_error(f"scheduler/{name}", repr(e))
+                except Exception:
+                    pass
+                stop.wait(self.restart_delay)
@@ -1,15 +1,17 @@
 """Cleanup junk projects created from newsletter/spam emails"""
 from app.database import Database
 
+# Show current projects (streamed through a server-side cursor)
+with Database.get_cursor() as cur:
+    cur.execute("SELECT COUNT(*) AS cnt FROM projects")
+    print(f"Total projects: {cur.fetchone()['cnt']}")
+for p in Database.stream_rows(
+        "SELECT id, title, current_state FROM projects ORDER BY id",
+        name='cleanup_projects', itersize=2000):
+    title = p["title"][:70] if p["title"] else "NO TITLE"
+    print(f"  #{p['id']}: [{p['current_state']}] {title}")
+
 with Database.get_cursor() as cur:
-    # Show current projects
-    cur.execute("SELECT id, title, current_state FROM projects ORDER BY id")
-    projects = cur.fetchall()
-    print(f"Total projects: {len(projects)}")
-    for p in projects:
-        title = p["title"][:70] if p["title"] else "NO TITLE"
-        print(f"  #{p['id']}: [{p['current_state']}] {title}")
-    
     # Count messages with NULL recipient
     cur.execute("SELECT COUNT(*) as cnt FROM project_messages WHERE recipient_email IS NULL AND direction = 'outbound'")
     null_count = cur.fetchone()["cnt"]
@@ -23,24 +25,35 @@ with Database.get_cursor() as cur:
 print("\n--- Cleaning up ---")
 
 with Database.get_cursor() as cur:
-    # Delete junk projects (id >= 4, created from spam emails)
-    cur.execute("DELETE FROM agent_logs WHERE project_id >= 4")
-    print(f"Deleted agent_logs for junk projects: {cur.rowcount}")
-    
-    cur.execute("DELETE FROM project_states WHERE project_id >= 4")
-    print(f"Deleted project_states for junk projects: {cur.rowcount}")
-    
-    cur.execute("DELETE FROM project_messages WHERE project_id >= 4")
-    print(f"Deleted project_messages for junk projects: {cur.rowcount}")
-    
-    cur.execute("DELETE FROM tasks WHERE project_id >= 4")
-    print(f"Deleted tasks for junk projects: {cur.rowcount}")
-    
-    cur.execute("DELETE FROM projects WHERE id >= 4")
-    print(f"Deleted junk projects: {cur.rowcount}")
-
-    # Mark outbound messages with NULL recipient as processed (can't send anyway)
-    cur.execute("UPDATE project_messages SET is_processed = TRUE WHERE recipient_email IS NULL AND direction = 'outbound'")
-    print(f"Marked NULL-recipient outbound messages as processed: {cur.rowcount}")
+    # One statement (one round-trip, all-or-nothing): delete junk projects
+    # (id >= 4, created from spam emails) with their logs, states, messages
+    # and tasks, and mark outbound messages with NULL recipient as processed
+    # (can't send anyway). The UPDATE skips rows the DELETE removes.
+    cur.execute("""
+        WITH logs AS (DELETE FROM agent_logs WHERE project_id >= 4 RETURNING 1),
+             states AS (DELETE FROM project_states WHERE project_id >= 4 RETURNING 1),
+             messages AS (DELETE FROM project_messages WHERE project_id >= 4 RETURNING 1),
+             tasks AS (DELETE FROM tasks WHERE project_id >= 4 RETURNING 1),
+             projects AS (DELETE FROM projects WHERE id >= 4 RETURNING 1),
+             null_recipients AS (
+                 UPDATE project_messages SET is_processed = TRUE
+                 WHERE recipient_email IS NULL AND direction = 'outbound'
+                   AND (project_id IS NULL OR project_id < 4)
+                 RETURNING 1
+             )
+        SELECT (SELECT COUNT(*) FROM logs) AS agent_logs,
+               (SELECT COUNT(*) FROM states) AS project_states,
+               (SELECT COUNT(*) FROM messages) AS project_messages,
+               (SELECT COUNT(*) FROM tasks) AS tasks,
+               (SELECT COUNT(*) FROM projects) AS projects,
+               (SELECT COUNT(*) FROM null_recipients) AS null_recipients
+    """)
+    counts = cur.fetchone()
+    print(f"Deleted agent_logs for junk projects: {counts['agent_logs']}")
+    print(f"Deleted project_states for junk projects: {counts['project_states']}")
+    print(f"Deleted project_messages for junk projects: {counts['project_messages']}")
+    print(f"Deleted tasks for junk projects: {counts['tasks']}")
+    print(f"Deleted junk projects: {counts['projects']}")
+    print(f"Marked NULL-recipient outbound messages as processed: {counts['null_recipients']}")
 
 print("\nDone! Database cleaned up.")
@@ -2,11 +2,11 @@
 AI Freelance Operator - Main Entry Point
 """
 
-from app import create_app
 from config import Config
 from app.database import Database
-from app.ai_client import get_ai_client
-from background.scheduler import BackgroundScheduler
+from app.logging_setup import setup_logging
+
+setup_logging()
 
 # Validate configuration
 print("=" * 60)
@@ -19,26 +19,27 @@ Config.validate()
 print("\nTesting connections...")
 Database.test_connection()
 
-try:
-    ai_client = get_ai_client()
-    ai_client.test_connection()
-except Exception as e:
-    print(f"⚠️  OpenAI API: {e}")
+# OpenAI is not probed here (a billable round-trip on every start);
+# the first real request validates the key, GET /health?deep=1 on demand
+if not Config.OPENAI_API_KEY:
+    print("⚠️  OpenAI API: OPENAI_API_KEY is not configured")
 
 print("\n" + "=" * 60)
 print(f"Starting Flask server on {Config.HOST}:{Config.PORT}")
 print("=" * 60 + "\n")
 
+# Heavy imports (Flask app, agents, OpenAI / IMAP clients) only after the
+# config has been validated and the connections reported
+from app import create_app
+from background.scheduler import BackgroundScheduler
+
 # Create and run Flask app
 app = create_app()
 
-# Start background processes only once (avoid duplicates in debug/reloader mode)
-import os
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not Config.DEBUG:
-    scheduler = BackgroundScheduler()
-    scheduler.start_all()
-else:
-    scheduler = None
+# Start background processes (the scheduler skips the reloader parent and
+# any process other than the one holding its database lock)
+scheduler = BackgroundScheduler()
+scheduler.start_all()
 
 if __name__ == "__main__":
     try:
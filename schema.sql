@@ -11,6 +11,9 @@ DROP TABLE IF EXISTS clients CASCADE;
 DROP TABLE IF EXISTS system_settings CASCADE;
 DROP TABLE IF EXISTS agent_instructions CASCADE;
 
+-- Trigram operators for substring (ILIKE '%...%') indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Clients table
 CREATE TABLE clients (
     id SERIAL PRIMARY KEY,
@@ -36,6 +39,8 @@ CREATE TABLE projects (
     client_id INTEGER REFERENCES clients(id) ON DELETE CASCADE,
     client_email VARCHAR(255), -- Direct email for quick access
     title VARCHAR(500) NOT NULL,
+    -- Title without "Re:" prefixes, lowercased — reply matching by equality
+    title_norm TEXT GENERATED ALWAYS AS (btrim(lower(regexp_replace(title, '^(re:\s*)+', '', 'i')))) STORED,
     description TEXT,
     category VARCHAR(100),
     complexity VARCHAR(50), -- MICRO, SMALL, MEDIUM, LARGE, RND
@@ -94,11 +99,13 @@ CREATE TABLE project_messages (
     sender_email VARCHAR(255),
     recipient_email VARCHAR(255),
     subject VARCHAR(500),
+    subject_norm TEXT GENERATED ALWAYS AS (btrim(lower(regexp_replace(subject, '^(re:\s*)+', '', 'i')))) STORED,
     body TEXT,
     html_body TEXT,
     message_id VARCHAR(255), -- Email message ID
     in_reply_to VARCHAR(255), -- Reference to previous message
     is_processed BOOLEAN DEFAULT FALSE,
+    claimed_at TIMESTAMP, -- Outbound: reserved by a sender drain (EmailSender)
     metadata JSONB, -- Headers, attachments info, etc.
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -145,10 +152,19 @@ CREATE INDEX idx_clients_email ON clients(email);
 CREATE INDEX idx_projects_client_id ON projects(client_id);
 CREATE INDEX idx_projects_current_state ON projects(current_state);
 CREATE INDEX idx_projects_created_at ON projects(created_at);
+CREATE INDEX idx_projects_state_created ON projects(current_state, created_at, id);
 CREATE INDEX idx_tasks_project_id ON tasks(project_id);
 CREATE INDEX idx_project_states_project_id ON project_states(project_id);
 CREATE INDEX idx_project_messages_project_id ON project_messages(project_id);
 CREATE INDEX idx_project_messages_created_at ON project_messages(created_at);
+CREATE INDEX idx_project_messages_message_id ON project_messages(message_id) WHERE message_id IS NOT NULL;
+CREATE INDEX idx_projects_title_trgm ON projects USING gin (title gin_trgm_ops);
+CREATE INDEX idx_projects_title_norm ON projects(title_norm);
+CREATE INDEX idx_project_messages_subject_norm ON project_messages(subject_norm);
+CREATE INDEX idx_project_messages_pending_outbound ON project_messages(created_at)
+    WHERE direction = 'outbound' AND is_processed = FALSE;
+CREATE INDEX idx_project_messages_null_outbound ON project_messages(id)
+    WHERE recipient_email IS NULL AND direction = 'outbound';
 CREATE INDEX idx_agent_logs_agent_name ON agent_logs(agent_name);
 CREATE INDEX idx_agent_logs_created_at ON agent_logs(created_at);
 CREATE INDEX idx_system_settings_key ON system_settings(setting_key);
@@ -233,6 +249,19 @@ CREATE TRIGGER update_projects_updated_at BEFORE UPDATE ON projects
 CREATE TRIGGER update_tasks_updated_at BEFORE UPDATE ON tasks
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Wake the mail worker (LISTEN email_pending) when outbound mail is queued
+CREATE OR REPLACE FUNCTION notify_email_pending()
+RETURNS TRIGGER AS $$
+BEGIN
+    NOTIFY email_pending;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_project_messages_outbound AFTER INSERT ON project_messages
+    FOR EACH ROW WHEN (NEW.direction = 'outbound' AND NEW.is_processed IS NOT TRUE)
+    EXECUTE FUNCTION notify_email_pending();
+
 -- Comments for documentation
 COMMENT ON TABLE clients IS 'Client information and reputation tracking';
 COMMENT ON TABLE projects IS 'Main projects table with state machine tracking';